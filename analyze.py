@@ -1,12 +1,16 @@
 import collections
 import copy
+import multiprocessing
 import re
-import sys
 
-from entry import Entry, Application, Rating, jsonDecode, loadEntries
+from analyzeCache import AnalyzeCache
+from catalogStore import CatalogStore
+from entry import Entry, Application, Rating, jsonDecode, loadEntries, loadYearEntries
 from filter import (extractArchitecture, extractMultipleVersionNumbers, extractVersionNumber, stripBetweenParens, stripFirstHyphen, stripFirstWords, 
     stripSpacing, stripStringsFromStringIfNeeded, stripStrippableWords)
+from memoize import memoize, mergeMemoizeStats, printMemoizeStats, setMemoizeEnabled, takeMemoizeStats
 from util import firstOrNone, isYear, save, stripMultipleSpaces, stripStringFromString
+from version import VERSION_KEY, parseVersion, versionRange
 
 MAC_SYSTEM_NUMBER = re.compile(r'(system|mac\s?os)\s?([0-9.x]+)', re.IGNORECASE)
 OS_NUMBER = re.compile(r'\b([0-9.X]+)\b')
@@ -16,6 +20,19 @@ INVALID_PATH_CHARS_MAP = {ord(c): ord('-') for c in '/:'}
 
 EXTENSION_MAP = {'image': 'img'}
 
+# HFS file name limit
+MAX_FILE_NAME_LENGTH = 31
+# Extensions as suggestFileName writes them, lowercase parts that don't start with a digit so version numbers stay out
+FILE_EXTENSION = re.compile(r'(\.[a-z][a-z0-9]*)+$')
+
+# Work is split into this many chunks per process to even out slow groups
+CHUNKS_PER_PROCESS = 4
+
+# Entry fields that affect analyzeEntry's result
+ANALYSIS_FIELDS = ['title', 'author', 'publisher', 'version', 'versionRange', 'downloads']
+
+analyzeCache = None
+
 def osVersionRange(osVersion):
     if osVersion is None:
         return None
@@ -42,6 +59,23 @@ def osVersionRange(osVersion):
 
     return (minOs, maxOs)
 
+@memoize()
+def buildPublisherDirectory(publisher):
+    # The publisher part of buildDirectory, the same for every entry from that publisher
+    originalPublisher = publisher
+
+    publisher = publisher.translate(INVALID_PATH_CHARS_MAP)
+
+    # Attempt to strip between parens
+    publisher = stripBetweenParens(publisher)
+
+    publisher = stripStrippableWords(publisher)
+
+    if len(publisher) > 31:
+        print 'Publisher ' + publisher + ' is too long (original "' + originalPublisher + '")'
+
+    return publisher
+
 """
 For now, simply returns the path of the "created" directory
 """
@@ -53,18 +87,8 @@ def buildDirectory(entry, includeVersion):
 
     if publisher is None:
         publisher = u'Unknown'
-        
-    originalPublisher = publisher
-
-    publisher = publisher.translate(INVALID_PATH_CHARS_MAP)
-
-    # Attempt to strip between parens
-    publisher = stripBetweenParens(publisher)
 
-    publisher = stripStrippableWords(publisher)
-
-    if len(publisher) > 31:
-        print 'Publisher ' + publisher + ' is too long (original "' + originalPublisher + '")'
+    publisher = buildPublisherDirectory(publisher)
 
     productName = entry.title
     productName = productName.translate(INVALID_PATH_CHARS_MAP)
@@ -143,11 +167,22 @@ def suggestFileName(entry, download, includeExtension=True):
     strippedTitle = newTitle.replace(':', ' - ')
 
     fileName = stripMultipleSpaces(strippedTitle + versionNumber + extension)
+    fileName = shortenFileName(fileName, entry.author, entry.publisher)
+
+    fileName = fileName.translate(INVALID_PATH_CHARS_MAP)
+
+    return fileName.encode('ascii', 'ignore')
 
-    if len(fileName) > 31:
+@memoize()
+def shortenFileName(fileName, authors, publishers):
+    # The same for every download of a multi-version group that ends up with the same name.
+    # Still one pass after another: each decides what to strip from what the previous one left,
+    # e.g. the first hyphen only after the parens are gone, and each returns as soon as the name
+    # fits, so names that are short enough (nearly all of them) never get past this check
+    if len(fileName) > MAX_FILE_NAME_LENGTH:
         # Attempt to strip publisher/author name
-        fileName = stripStringsFromStringIfNeeded(entry.author, fileName)
-        fileName = stripStringsFromStringIfNeeded(entry.publisher, fileName)
+        fileName = stripStringsFromStringIfNeeded(authors, fileName)
+        fileName = stripStringsFromStringIfNeeded(publishers, fileName)
 
         # Attempt to strip between parens
         fileName = stripBetweenParens(fileName)
@@ -165,167 +200,349 @@ def suggestFileName(entry, download, includeExtension=True):
         # Stripping spacing wasn't enough, start dropping words
         fileName = stripFirstWords(fileName, spacedShrunkFileName)
 
-        if len(fileName) <= 31:
-            # print 'Successfully shrunk ' + fileName
-            pass
-        else:
-            print 'Failed to shrink ' + fileName
+    return fileName
 
-    fileName = fileName.translate(INVALID_PATH_CHARS_MAP)
+def planFileNames(fileNames):
+    # Unique names for one directory. Returns (names, names still too long).
+    # Later duplicates get the lowest free " 2", " 3"... suffix, so the plan only depends on the order given
+    plannedNames = []
+    usedNames = set()
+    nextSuffixes = {}
+    unshortened = []
 
-    return fileName.encode('ascii', 'ignore')
+    for fileName in fileNames:
+        plannedName = fileName
+
+        if plannedName in usedNames:
+            suffixNumber = nextSuffixes.get(fileName, 2)
+            # The suffix goes before the extension, "Name 2.sit" rather than "Name.sit 2"
+            extensionMatch = FILE_EXTENSION.search(fileName)
+            extension = extensionMatch.group(0) if extensionMatch else ''
+            baseName = fileName[:len(fileName) - len(extension)]
+
+            while plannedName in usedNames:
+                suffix = ' ' + str(suffixNumber)
+                plannedName = baseName[:max(MAX_FILE_NAME_LENGTH - len(suffix) - len(extension), 0)].rstrip() + suffix + extension
+                suffixNumber += 1
+
+            nextSuffixes[fileName] = suffixNumber
+
+        usedNames.add(plannedName)
+        plannedNames.append(plannedName)
+
+        if len(plannedName) > MAX_FILE_NAME_LENGTH:
+            unshortened.append(plannedName)
+
+    return (plannedNames, unshortened)
+
+def planDirectories(placements):
+    # Plans every directory at once, placements in the order analyze.main applies them.
+    # Returns (directory, file name) for each name that couldn't be shortened
+    directories = collections.OrderedDict()
+
+    for placement in placements:
+        directories.setdefault(placement['directory'], []).append(placement)
+
+    unshortened = []
+
+    for directory, directoryPlacements in directories.iteritems():
+        plannedNames, directoryUnshortened = planFileNames([placement['filename'] for placement in directoryPlacements])
+
+        for placement, plannedName in zip(directoryPlacements, plannedNames):
+            placement['filename'] = plannedName
+
+        unshortened.extend((directory, fileName) for fileName in directoryUnshortened)
+
+    return unshortened
+
+@memoize()
+def downloadNameVersion(name):
+    # The last version number in a download name that parses, None if there isn't one
+    nameVersion = None
+
+    for versionText in extractMultipleVersionNumbers(name, False) or []:
+        version = parseVersion(versionText)
+
+        if version is not None:
+            nameVersion = version
+
+    return nameVersion
+
+def versionsDiffer(version, minVersion):
+    # More than 2 apart, comparing major.minor like 1.0 and 3.5 rather than only the majors
+    return version.number - minVersion.number > 2
+
+def repairVersion(version, minVersion):
+    # Digits that lost their period, e.g. "12" next to "1.0" was 1.2
+    if not versionsDiffer(version, minVersion) or not version.text.isdigit():
+        return version
+
+    repairedVersion = parseVersion(version.text[0] + '.' + version.text[1:])
+
+    if versionsDiffer(repairedVersion, minVersion):
+        return version
+
+    return repairedVersion
 
 def extractDownloadRange(downloads):
-    versionNumberList = []
-    versionList = []
-
-    for index, download in enumerate(downloads):
-        useUnderscores = False
-        lastVersionNumber = 0
-        completed = False
-        while not completed:
-            completed = True
-            multipleVersionNumbers = extractMultipleVersionNumbers(download.name, useUnderscores)
-
-            if multipleVersionNumbers:
-                for versionText in multipleVersionNumbers:
-                    versionNumberOnly = re.sub(r'[a-zA-Z]', '', versionText)
-
-                    versionNumber = 0
-
-                    try:
-                        versionNumber = float(versionNumberOnly)
-                    except:
-                        continue
-
-                    if len(versionNumberList) > index:
-                        versionNumberList[index] = versionNumber
-                        versionList[index] = versionText
-                    else:
-                        versionNumberList.append(versionNumber)
-                        versionList.append(versionText)
-
-                    if not useUnderscores and versionNumber < lastVersionNumber:
-                        # Decreasing version numbers in file name. Attempting underscore
-                        useUnderscores = True
-                        completed = False
-
-    if len(versionNumberList) < 1:
+    versions = []
+    versionNames = []
+
+    for download in downloads:
+        version = downloadNameVersion(download.name)
+
+        if version is not None:
+            versions.append(version)
+            versionNames.append(download.name)
+
+    if len(versions) < 1:
         return None
-    
-    # Determine max and min
-    minVersionNumber = sys.maxint
-    minVersion = None
-    maxVersionNumber = 0
-    maxVersion = None
-
-    currentMinVersionNumber = min(versionNumberList)
-    for index, version in enumerate(versionNumberList):
-        if version - currentMinVersionNumber > 2:
-            print 'Version number ' + str(currentMinVersionNumber) + ' and ' + str(version) + ' for ' + download.name + ' differ by more than 2'
-            while (version > currentMinVersionNumber):
-                version = version / 10
-            
-            versionNumberList[index] = version
-            # Overwrite extracted version name (may be bad)
-            versionList[index] = str(version)
-
-    for index, version in enumerate(versionNumberList):
-        versionText = versionList[index]
-
-        if version < minVersionNumber:
-            minVersionNumber = version
-            minVersion = versionText
-        if version > maxVersionNumber:
-            maxVersionNumber = version
-            maxVersion = versionText
-                
-    if minVersion and maxVersion:
-        return (minVersion, maxVersion)
-
-    return None
+
+    minVersion = min(versions, key=VERSION_KEY)
+
+    for index, version in enumerate(versions):
+        if versionsDiffer(version, minVersion):
+            print 'Version number ' + minVersion.text + ' and ' + version.text + ' for ' + versionNames[index] + ' differ by more than 2'
+            versions[index] = repairVersion(version, minVersion)
+
+    minVersion, maxVersion = versionRange(versions)
+
+    return (minVersion.text, maxVersion.text)
+
+def analyzeEntry(entry, multiversion):
+    hasDownloads = hasattr(entry, 'downloads')
+
+    if hasDownloads:
+        downloadRange = extractDownloadRange(entry.downloads)
+
+        if downloadRange and not hasattr(entry, 'versionRange'):
+            if downloadRange[0] == downloadRange[1]:
+                entry.version = downloadRange[0]
+            else:
+                entry.version = downloadRange[0] + '-' + downloadRange[1]
+                entry.versionRange = True
+
+    directory = buildDirectory(entry, multiversion)
+
+    downloadResults = None
+
+    if hasDownloads:
+        downloadResults = []
+        for download in entry.downloads:
+            # Names are made unique per directory afterwards, by planDirectories
+            fileName = suggestFileName(entry, download, False)
+            downloadResults.append((fileName, osVersionRange(download.version)))
+
+    # Kept to plain tuples so cached results are small and quick to load
+    return (getattr(entry, 'version', None), hasattr(entry, 'versionRange'), directory, downloadResults)
+
+def applyEntryResult(entry, result):
+    version, versionRange, directory, downloadResults = result
+
+    if version is not None:
+        entry.version = version
+
+    if versionRange:
+        entry.versionRange = True
+
+    if downloadResults is None:
+        return None
+
+    downloads = []
+    for download, (fileName, osVersions) in zip(entry.downloads, downloadResults):
+        if osVersions is not None:
+            download.minOs = osVersions[0]
+            download.maxOs = osVersions[1]
+
+        downloads.append({
+            'directory': directory,
+            'filename': fileName,
+            'download': download,
+        })
+
+    return downloads
+
+def analysisInputs(entry):
+    # Every field analyzeEntry reads. Cache keys skip the rest, descriptions are most of an entry
+    return dict((field, getattr(entry, field)) for field in ANALYSIS_FIELDS if hasattr(entry, field))
+
+def analyzeGroup(entries):
+    multiversion = len(entries) > 1
+
+    # Only entries that changed since the last run are recomputed
+    return [cachedCall(analyzeEntry, (entry, multiversion), (analysisInputs(entry), multiversion)) for entry in entries]
+
+def analysisEntry(entry):
+    # Only what analyzeEntry reads, so worker processes aren't sent whole descriptions
+    return Entry.fromDict(analysisInputs(entry))
+
+def initAnalyzeWorker(useAnalyzeCache):
+    # The parent's sqlite connection can't be shared across fork
+    setAnalyzeCache(AnalyzeCache(deferWrites=True) if useAnalyzeCache else None)
+    # Counts inherited from the parent would be merged back twice
+    takeMemoizeStats()
+
+def analyzeGroupsWorker(groups):
+    results = [analyzeGroup(entries) for entries in groups]
+    work = analyzeCache.takeWork() if analyzeCache is not None else None
+
+    return (results, work, takeMemoizeStats())
+
+def analyzeTitleGroups(groupedEntries, processes):
+    # Returns {title: analyzeGroup results}, the same whether run serially or in parallel
+    groupResults = {}
+    groupKeys = {}
+    missed = []
+
+    for title in sorted(groupedEntries):
+        if analyzeCache is not None:
+            # Unchanged groups come straight from the cache
+            key, found, results = analyzeCache.lookup(analyzeGroup, [analysisInputs(entry) for entry in groupedEntries[title]])
+
+            if found:
+                groupResults[title] = results
+                continue
+
+            groupKeys[title] = key
+
+        missed.append(title)
+
+    if processes > 1 and len(missed) > 1:
+        chunkSize = max(1, len(missed) // (processes * CHUNKS_PER_PROCESS))
+        chunks = [missed[index:index + chunkSize] for index in range(0, len(missed), chunkSize)]
+
+        pool = multiprocessing.Pool(processes, initAnalyzeWorker, (analyzeCache is not None,))
+        try:
+            outputs = pool.map(analyzeGroupsWorker, [[[analysisEntry(entry) for entry in groupedEntries[title]] for title in chunk] for chunk in chunks])
+        finally:
+            pool.terminate()
+            pool.join()
+
+        # pool.map keeps chunk order, so the merge doesn't depend on which worker finished first
+        for chunk, (results, work, memoizeStats) in zip(chunks, outputs):
+            groupResults.update(zip(chunk, results))
+            mergeMemoizeStats(memoizeStats)
+
+            if work is not None:
+                analyzeCache.mergeWork(work)
+    else:
+        for title in missed:
+            groupResults[title] = analyzeGroup(groupedEntries[title])
+
+    if analyzeCache is not None:
+        for title in missed:
+            analyzeCache.store(groupKeys[title], analyzeGroup, groupResults[title])
+
+    return groupResults
+
+def setAnalyzeCache(cache):
+    global analyzeCache
+    analyzeCache = cache
+
+def cachedCall(function, args, inputs=None):
+    if analyzeCache is None:
+        return function(*args)
+
+    return analyzeCache.call(function, args, inputs)
+
+def splitTitleVersion(entry):
+    newEntry = copy.copy(entry)
+
+    versionNumberMatch = extractVersionNumber(entry.title, False)
+
+    if versionNumberMatch[2]:
+        # Version range
+        newEntry.versionRange = True
+
+    if versionNumberMatch[0] is not None:
+        newEntry.version = versionNumberMatch[0]
+        newEntry.title = versionNumberMatch[1]
+
+    return newEntry
 
 def main():
     # matchOnlyMGPath = ['/apps/aldus-pagemaker-12', '/apps/aldus-pagemaker-2', '/apps/aldus-pagemaker-301']
     matchOnlyMGPath = None
+    useSnapshots = True
+    # Read entries from data/catalog.db (see catalogStore.py) instead of the year files
+    useCatalog = False
+    # Reuse results from data/analyzeCache.db for entries and groups that haven't changed
+    useAnalyzeCache = True
+    # Title groups are analyzed in parallel across this many processes, 1 for serial
+    processes = multiprocessing.cpu_count()
+    # Keep results of the string normalisers for repeated publishers, titles and download names
+    useMemoize = True
+    firstYear = 1984
+    lastYear = 1989
 
-    entries = []
-
-    for year in range(1984, 1990):
-        entries.extend(loadEntries('data/' + str(year) + '.json'))
-
-    newEntries = []
     groupedEntries = {}
     entryPathToDownloads = {}
 
-    for entry in entries:
-        if matchOnlyMGPath and entry.source not in matchOnlyMGPath:
-            continue
-        newEntry = copy.copy(entry)
+    setMemoizeEnabled(useMemoize)
 
-        title = entry.title
+    if useAnalyzeCache:
+        setAnalyzeCache(AnalyzeCache())
 
-        versionNumberMatch = extractVersionNumber(title, False)
+    if useCatalog:
+        catalog = CatalogStore()
 
-        if versionNumberMatch[2]:
-            # Version range
-            newEntry.versionRange = True
+        # Already grouped by the catalog's groupTitle index
+        for title, titleEntries in catalog.groups(firstYear, lastYear):
+            titleEntries = [splitTitleVersion(entry) for entry in titleEntries if not matchOnlyMGPath or entry.source in matchOnlyMGPath]
 
-        if versionNumberMatch[0] is not None:
-            newEntry.version = versionNumberMatch[0]
-            newEntry.title = versionNumberMatch[1]
+            if titleEntries:
+                groupedEntries[title] = titleEntries
+    else:
+        entries = []
 
-        newEntries.append(newEntry)
+        for year in range(firstYear, lastYear + 1):
+            entries.extend(loadYearEntries(year, snapshot=useSnapshots))
 
-    for entry in newEntries:
-        if entry.title in groupedEntries:
-            currentEntries = groupedEntries[entry.title]
-            currentEntries.append(entry)
-        else:
-            groupedEntries[entry.title] = [entry]
+        newEntries = []
 
-    for title in groupedEntries:
-        entries = groupedEntries[title]
-        multiversion = len(entries) > 1
-        for entry in entries: 
-            hasDownloads = hasattr(entry, 'downloads')
+        for entry in entries:
+            if matchOnlyMGPath and entry.source not in matchOnlyMGPath:
+                continue
 
-            if hasDownloads:
-                downloadRange = extractDownloadRange(entry.downloads)
+            newEntries.append(splitTitleVersion(entry))
 
-                if downloadRange and not hasattr(entry, 'versionRange'):
-                    if downloadRange[0] == downloadRange[1]:
-                        entry.version = downloadRange[0]
-                    else:
-                        entry.version = downloadRange[0] + '-' + downloadRange[1]
-                        entry.versionRange = True
+        for entry in newEntries:
+            if entry.title in groupedEntries:
+                currentEntries = groupedEntries[entry.title]
+                currentEntries.append(entry)
+            else:
+                groupedEntries[entry.title] = [entry]
 
-            directory = buildDirectory(entry, multiversion)
+    groupResults = analyzeTitleGroups(groupedEntries, processes)
+    placements = []
 
-            if hasDownloads:
-                downloads = []
-                existingFileNames = set()
-                for download in entry.downloads:
-                    fileName = suggestFileName(entry, download, False)
+    for title in sorted(groupedEntries):
+        for entry, result in zip(groupedEntries[title], groupResults[title]):
+            downloads = applyEntryResult(entry, result)
 
-                    if fileName in existingFileNames:
-                        print 'Filename already exists ' + fileName
+            if downloads is not None:
+                entryPathToDownloads[entry.source] = downloads
+                placements.extend(downloads)
 
-                    osVersions = osVersionRange(download.version)
+    unshortened = planDirectories(placements)
 
-                    if osVersions is not None:
-                        download.minOs = osVersions[0]
-                        download.maxOs = osVersions[1]
+    for directory, fileName in unshortened:
+        print 'Failed to shrink ' + directory + fileName
 
-                    existingFileNames.add(fileName)
-                    
-                    downloads.append({
-                        'directory': directory,
-                        'filename': fileName,
-                        'download': download,
-                    })
+    print str(len(unshortened)) + ' file names longer than ' + str(MAX_FILE_NAME_LENGTH) + ' characters'
 
-                entryPathToDownloads[entry.source] = downloads
+    if useAnalyzeCache:
+        analyzeCache.close()
+        setAnalyzeCache(None)
+
+    if useMemoize:
+        printMemoizeStats()
+
+    if useCatalog:
+        for source, downloads in entryPathToDownloads.iteritems():
+            catalog.setPlacements(source, downloads)
+
+        catalog.close()
 
     orderedGroupedEntries = collections.OrderedDict(sorted(groupedEntries.iteritems()))
     orderedEntryPathToDownloads = collections.OrderedDict(sorted(entryPathToDownloads.iteritems()))
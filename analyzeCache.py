@@ -0,0 +1,259 @@
+import cPickle
+import hashlib
+import os
+import re
+import sqlite3
+import subprocess
+import sys
+import time
+import types
+
+from util import Encoder
+
+DEFAULT_ANALYZE_CACHE_PATH = 'data/analyzeCache.db'
+# Bump to discard every cached result, e.g. after changing something codeHash can't see,
+# like the arguments of an operator.attrgetter or a library upgrade
+ANALYZER_VERSION = 1
+# Results not used by any run for this long are dropped
+UNUSED_TTL = 30 * 24 * 60 * 60
+
+PATTERN_TYPE = type(re.compile(''))
+SCALAR_TYPES = (basestring, int, long, float, bool, type(None))
+CLASS_TYPES = (type, types.ClassType)
+# Classes defined in modules from here have their bodies hashed, library classes only by name
+REPO_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+# Module level caches filled in while running, (module, name). Their contents say nothing
+# about the code and would change the hash from one run to the next
+RUNTIME_GLOBALS = set([
+    ('util', 'stripPatterns'),
+    ('version', 'parsedVersions'),
+    ('memoize', 'memoizedFunctions'),
+    ('analyzeCache', 'codeHashes'),
+])
+
+codeHashes = {}
+# Unsorted keys let json use its C encoder, and the models always emit fields in slot order
+keyEncoder = Encoder()
+
+def addCode(digest, code, globals, seen):
+    # Bytecode rather than source, so moving lines or editing comments keeps results
+    digest.update(code.co_code)
+
+    for constant in code.co_consts:
+        if isinstance(constant, types.CodeType):
+            addCode(digest, constant, globals, seen)
+        else:
+            digest.update(repr(constant))
+
+    for name in code.co_names:
+        addGlobal(digest, name, globals, seen)
+
+def addGlobal(digest, name, globals, seen):
+    # co_names also holds attribute names, which simply aren't found in globals
+    key = (id(globals), name)
+
+    if key in seen or name not in globals or (globals.get('__name__'), name) in RUNTIME_GLOBALS:
+        return
+
+    seen.add(key)
+    digest.update(name)
+    addValue(digest, globals[name], seen)
+
+def addValue(digest, value, seen):
+    # Only what stays the same from one interpreter to the next, never a repr with an address in it
+    # memoize.Memoized and similar wrappers keep the function itself here
+    value = getattr(value, '__wrapped__', value)
+
+    if isinstance(value, types.FunctionType):
+        addCode(digest, value.func_code, value.func_globals, seen)
+    elif isinstance(value, (staticmethod, classmethod)):
+        addValue(digest, value.__func__, seen)
+    elif isinstance(value, property):
+        digest.update('property')
+
+        for accessor in (value.fget, value.fset, value.fdel):
+            addValue(digest, accessor, seen)
+    elif isinstance(value, CLASS_TYPES) and isRepoClass(value):
+        addClass(digest, value, seen)
+    elif isinstance(value, PATTERN_TYPE):
+        digest.update(repr((value.pattern, value.flags)))
+    elif isinstance(value, SCALAR_TYPES):
+        digest.update(repr(value))
+    elif isinstance(value, (list, tuple)):
+        digest.update(type(value).__name__)
+
+        for item in value:
+            addValue(digest, item, seen)
+    elif isinstance(value, (set, frozenset)):
+        digest.update(type(value).__name__)
+
+        for item in sorted(value):
+            addValue(digest, item, seen)
+    elif isinstance(value, dict):
+        digest.update('dict')
+
+        for itemKey in sorted(value):
+            addValue(digest, itemKey, seen)
+            addValue(digest, value[itemKey], seen)
+    else:
+        # Modules, library classes and other objects: only what kind of thing it is
+        digest.update(type(value).__name__)
+
+def isRepoClass(cls):
+    module = sys.modules.get(cls.__module__)
+    path = getattr(module, '__file__', None)
+
+    return path is not None and os.path.dirname(os.path.abspath(path)) == REPO_DIRECTORY
+
+def addClass(digest, cls, seen):
+    # Methods, properties and class constants, so editing e.g. Version.number invalidates what uses it
+    key = ('class', id(cls))
+
+    if key in seen:
+        digest.update(cls.__name__)
+        return
+
+    seen.add(key)
+    digest.update('class ' + cls.__name__)
+
+    for base in cls.__bases__:
+        addValue(digest, base, seen)
+
+    for name in sorted(vars(cls)):
+        if name == '__doc__':
+            continue
+
+        digest.update(name)
+        addValue(digest, vars(cls)[name], seen)
+
+def codeHash(function):
+    # Covers the function and every function, class, regex and constant it reaches through
+    # module globals, so tuning one heuristic only invalidates results that use it
+    hashValue = codeHashes.get(function)
+
+    if hashValue is None:
+        digest = hashlib.sha1(str(ANALYZER_VERSION))
+        addCode(digest, function.func_code, function.func_globals, set())
+        hashValue = digest.hexdigest()
+        codeHashes[function] = hashValue
+
+    return hashValue
+
+class AnalyzeCache(object):
+    def __init__(self, path=DEFAULT_ANALYZE_CACHE_PATH, deferWrites=False):
+        self.connection = sqlite3.connect(path, timeout=60)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, function TEXT, lastUsed REAL, value BLOB)')
+        self.connection.commit()
+
+        self.started = time.time()
+        self.usedKeys = []
+        self.hits = 0
+        self.misses = 0
+        # Worker processes hand their new results back instead of writing them
+        self.deferred = [] if deferWrites else None
+
+    def key(self, function, inputs):
+        return hashlib.sha1(codeHash(function) + keyEncoder.encode(inputs)).hexdigest()
+
+    def lookup(self, function, inputs):
+        # Returns (key, found, value)
+        key = self.key(function, inputs)
+        row = self.connection.execute('SELECT value FROM results WHERE key = ?', (key,)).fetchone()
+
+        if row is None:
+            self.misses += 1
+            return (key, False, None)
+
+        self.hits += 1
+        self.usedKeys.append((self.started, key))
+
+        return (key, True, cPickle.loads(str(row[0])))
+
+    def store(self, key, function, value):
+        row = (key, function.__name__, self.started, cPickle.dumps(value, cPickle.HIGHEST_PROTOCOL))
+
+        if self.deferred is not None:
+            # Kept as str, sqlite3.Binary buffers don't survive the trip back to the parent
+            self.deferred.append(row)
+        else:
+            self.insert([row])
+
+    def insert(self, rows):
+        self.connection.executemany('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)',
+            ((key, name, lastUsed, sqlite3.Binary(value)) for key, name, lastUsed, value in rows))
+
+    def call(self, function, args, inputs=None):
+        # inputs stands in for args in the key when only part of them affects the result.
+        # The key must be taken before calling, functions may update their arguments
+        if inputs is None:
+            inputs = args
+
+        key, found, value = self.lookup(function, inputs)
+
+        if found:
+            return value
+
+        value = function(*args)
+        self.store(key, function, value)
+
+        return value
+
+    def takeWork(self):
+        # Deferred rows and counts since the last call, for merging into the parent's cache
+        work = (self.deferred, self.usedKeys, self.hits, self.misses)
+
+        self.deferred = []
+        self.usedKeys = []
+        self.hits = 0
+        self.misses = 0
+
+        return work
+
+    def mergeWork(self, work):
+        deferred, usedKeys, hits, misses = work
+
+        self.insert(deferred)
+        self.usedKeys.extend(usedKeys)
+        self.hits += hits
+        self.misses += misses
+
+    def close(self):
+        self.connection.executemany('UPDATE results SET lastUsed = ? WHERE key = ?', self.usedKeys)
+        self.connection.execute('DELETE FROM results WHERE lastUsed < ?', (self.started - UNUSED_TTL,))
+        self.connection.commit()
+        self.connection.close()
+
+        print 'Analyze cache: ' + str(self.hits) + ' hits, ' + str(self.misses) + ' misses'
+
+def printCodeHashes():
+    # The hashes results are stored under, see checkCodeHashes
+    import analyze
+
+    for function in [analyze.analyzeEntry, analyze.analyzeGroup]:
+        print function.__name__ + ' ' + codeHash(function)
+
+def checkCodeHashes():
+    # Each run has to come up with the same hashes, or no result is ever found again
+    outputs = [subprocess.check_output([sys.executable, '-c', 'import analyzeCache; analyzeCache.printCodeHashes()'])
+        for run in range(2)]
+
+    print outputs[0].strip()
+
+    if outputs[0] != outputs[1]:
+        print 'Code hashes differ between runs:'
+        print outputs[1].strip()
+        sys.exit(1)
+
+    print 'Code hashes are the same across runs'
+
+def main():
+    # python analyzeCache.py check
+    if len(sys.argv) < 2 or sys.argv[1] != 'check':
+        print 'Usage: analyzeCache.py check'
+        sys.exit(1)
+
+    checkCodeHashes()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+import sys
+import time
+from bs4 import NavigableString
+
+from responseCache import DEFAULT_CACHE_PATH, ResponseCache
+from scrape import NEWLINE_TAGS, TEXT_TAGS, entrySoup, flattenAndCombineStringTags, isStringless
+from util import concatStringsWithSpace
+
+"""
+The original recursive implementation, kept as the reference output for the iterative engine
+"""
+def flattenRecursive(domElement):
+    foundStrings = []
+    currentString = ''
+
+    if isStringless(domElement):
+        return []
+
+    for element in domElement.children:
+        if isinstance(element, NavigableString):
+            currentString = concatStringsWithSpace(currentString, unicode(element))
+        elif isStringless(element):
+            break
+        elif element.name in NEWLINE_TAGS:
+            if currentString != '':
+                foundStrings.append(currentString)
+                currentString = ''
+            foundStrings.extend(flattenRecursive(element))
+        elif element.name in TEXT_TAGS:
+            strings = flattenRecursive(element)
+            length = len(strings)
+            if length > 1:
+                if currentString != '':
+                    foundStrings.append(currentString)
+                    currentString = ''
+                foundStrings.extend(strings)
+            elif length == 1:
+                currentString = concatStringsWithSpace(currentString, strings[0])
+        else:
+            foundStrings.extend(flattenRecursive(element))
+
+    if currentString != '':
+        foundStrings.append(currentString)
+
+    return foundStrings
+
+def descriptionElements(soup):
+    gamePreview = soup.find(class_='game-preview')
+
+    if gamePreview is None:
+        return []
+
+    elements = []
+
+    element = gamePreview.nextSibling
+    while (element is not None):
+        if not isinstance(element, NavigableString):
+            if element.get('id') == 'comments':
+                break
+
+            elements.append(element)
+
+        element = element.nextSibling
+
+    return elements
+
+def timeFlatten(function, elements, repeat):
+    start = time.time()
+
+    for i in range(repeat):
+        for element in elements:
+            function(element)
+
+    return time.time() - start
+
+def main():
+    cachePath = DEFAULT_CACHE_PATH
+    if len(sys.argv) > 1:
+        cachePath = sys.argv[1]
+
+    largest = 50
+    repeat = 20
+
+    cache = ResponseCache(cachePath, offline=True)
+
+    pages = []
+    for path in cache.paths():
+        if path.startswith('/year/'):
+            continue
+
+        elements = descriptionElements(entrySoup(cache.get(path)))
+        size = sum(len(element.get_text()) for element in elements)
+        pages.append((size, path, elements))
+
+    cache.close()
+
+    pages.sort(reverse=True)
+    pages = pages[:largest]
+
+    elements = []
+    mismatches = 0
+    for size, path, pageElements in pages:
+        for element in pageElements:
+            if flattenRecursive(element) != flattenAndCombineStringTags(element):
+                print 'Output differs for ' + path
+                mismatches += 1
+
+        elements.extend(pageElements)
+
+    recursiveTime = timeFlatten(flattenRecursive, elements, repeat)
+    iterativeTime = timeFlatten(flattenAndCombineStringTags, elements, repeat)
+
+    print 'Largest ' + str(len(pages)) + ' description pages, ' + str(repeat) + ' runs each'
+    print 'Recursive: %.3fs' % recursiveTime
+    print 'Iterative: %.3fs' % iterativeTime
+    print str(mismatches) + ' mismatches'
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,6 @@
 import os, shutil, errno
 
+from catalogStore import CatalogStore
 from entry import loadEntries
 
 APPS_DIR = 'Macintosh_Garden_Apps_Collection_'
@@ -53,8 +54,18 @@ def main():
     outputRoot = 'Y:/Downloads/Processed/'
     archiveRoot = 'Y:/Downloads/complete/'
 
-    groupedEntries = loadEntries('groupedEntries.json')
-    entryPathToDownloads = loadEntries('entryPathToDownloads.json')
+    useSnapshots = True
+    # Read analyze's placements from data/catalog.db (see catalogStore.py) instead of its JSON output
+    useCatalog = False
+
+    if useCatalog:
+        catalog = CatalogStore()
+        groupedEntries = dict(catalog.groups())
+        entryPathToDownloads = catalog.placements()
+        catalog.close()
+    else:
+        groupedEntries = loadEntries('groupedEntries.json', useSnapshots)
+        entryPathToDownloads = loadEntries('entryPathToDownloads.json', useSnapshots)
 
     limit = 1000
     count = 0
@@ -0,0 +1,256 @@
+import itertools
+import sqlite3
+import sys
+
+from entry import Application, decoder, iterYearEntries
+from filter import extractVersionNumber
+from util import toJSON
+
+DEFAULT_CATALOG_PATH = 'data/catalog.db'
+
+# Fields stored as lists of names, each in its own table so they can be indexed
+LIST_FIELDS = [
+    ('author', 'entryAuthors'),
+    ('publisher', 'entryPublishers'),
+    ('category', 'entryCategories'),
+]
+
+SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS entries (source TEXT PRIMARY KEY, listYear INTEGER, position INTEGER, title TEXT, groupTitle TEXT, type TEXT, year INTEGER, data TEXT)',
+    'CREATE TABLE IF NOT EXISTS entryAuthors (source TEXT, author TEXT)',
+    'CREATE TABLE IF NOT EXISTS entryPublishers (source TEXT, publisher TEXT)',
+    'CREATE TABLE IF NOT EXISTS entryCategories (source TEXT, category TEXT)',
+    'CREATE TABLE IF NOT EXISTS downloads (source TEXT, position INTEGER, name TEXT, size TEXT, version TEXT, directory TEXT, filename TEXT, minOs REAL, maxOs REAL)',
+    'CREATE TABLE IF NOT EXISTS manuals (source TEXT, position INTEGER, name TEXT)',
+    'CREATE INDEX IF NOT EXISTS entriesTitle ON entries (title)',
+    'CREATE INDEX IF NOT EXISTS entriesGroupTitle ON entries (groupTitle, listYear, position)',
+    'CREATE INDEX IF NOT EXISTS entriesListYear ON entries (listYear, position)',
+    'CREATE INDEX IF NOT EXISTS entriesYear ON entries (year)',
+    'CREATE INDEX IF NOT EXISTS entriesType ON entries (type)',
+    'CREATE INDEX IF NOT EXISTS entryAuthorsAuthor ON entryAuthors (author)',
+    'CREATE INDEX IF NOT EXISTS entryAuthorsSource ON entryAuthors (source)',
+    'CREATE INDEX IF NOT EXISTS entryPublishersPublisher ON entryPublishers (publisher)',
+    'CREATE INDEX IF NOT EXISTS entryPublishersSource ON entryPublishers (source)',
+    'CREATE INDEX IF NOT EXISTS entryCategoriesCategory ON entryCategories (category)',
+    'CREATE INDEX IF NOT EXISTS entryCategoriesSource ON entryCategories (source)',
+    'CREATE INDEX IF NOT EXISTS downloadsSource ON downloads (source, position)',
+    'CREATE INDEX IF NOT EXISTS downloadsName ON downloads (name)',
+    'CREATE INDEX IF NOT EXISTS manualsSource ON manuals (source, position)',
+]
+
+# Lookup name -> (join table, column), None for columns on entries itself
+LOOKUPS = {
+    'source': (None, 'source'),
+    'title': (None, 'title'),
+    'group': (None, 'groupTitle'),
+    'year': (None, 'year'),
+    'type': (None, 'type'),
+    'author': ('entryAuthors', 'author'),
+    'publisher': ('entryPublishers', 'publisher'),
+    'category': ('entryCategories', 'category'),
+}
+
+def listValues(value):
+    if value is None:
+        return []
+
+    if isinstance(value, basestring):
+        return [value]
+
+    return value
+
+def groupTitle(entry):
+    # Same title analyze.main groups by once any version number is stripped
+    return extractVersionNumber(entry.title, False)[1]
+
+class CatalogStore(object):
+    def __init__(self, path=DEFAULT_CATALOG_PATH):
+        self.connection = sqlite3.connect(path, timeout=60)
+
+        for statement in SCHEMA:
+            self.connection.execute(statement)
+
+        self.connection.commit()
+
+    def removeSource(self, source):
+        self.connection.execute('DELETE FROM entries WHERE source = ?', (source,))
+        self.connection.execute('DELETE FROM downloads WHERE source = ?', (source,))
+        self.connection.execute('DELETE FROM manuals WHERE source = ?', (source,))
+
+        for field, table in LIST_FIELDS:
+            self.connection.execute('DELETE FROM ' + table + ' WHERE source = ?', (source,))
+
+    def addEntry(self, entry, listYear, position):
+        source = entry.source
+        self.removeSource(source)
+
+        self.connection.execute('INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (source, listYear, position, entry.title, groupTitle(entry), entry.type, entry.year, toJSON(entry)))
+
+        for field, table in LIST_FIELDS:
+            for value in listValues(getattr(entry, field)):
+                self.connection.execute('INSERT INTO ' + table + ' VALUES (?, ?)', (source, value))
+
+        for index, download in enumerate(getattr(entry, 'downloads', [])):
+            self.connection.execute('INSERT INTO downloads VALUES (?, ?, ?, ?, ?, NULL, NULL, NULL, NULL)',
+                (source, index, download.name, download.size, download.version))
+
+        for index, manual in enumerate(getattr(entry, 'manuals', [])):
+            self.connection.execute('INSERT INTO manuals VALUES (?, ?, ?)', (source, index, manual))
+
+    def importEntries(self, entries, listYear):
+        count = 0
+
+        for position, entry in enumerate(entries):
+            if entry is None:
+                continue
+
+            self.addEntry(entry, listYear, position)
+            count += 1
+
+        self.connection.commit()
+
+        return count
+
+    def importYears(self, years, directory='data/'):
+        count = 0
+
+        for year in years:
+            yearCount = self.importEntries(iterYearEntries(year, directory), year)
+            print 'Imported ' + str(yearCount) + ' entries for ' + str(year)
+            count += yearCount
+
+        return count
+
+    def decodeRows(self, rows):
+        return [decoder.decode(row[0]) for row in rows]
+
+    def get(self, source):
+        row = self.connection.execute('SELECT data FROM entries WHERE source = ?', (source,)).fetchone()
+
+        if row is None:
+            return None
+
+        return decoder.decode(row[0])
+
+    def find(self, **criteria):
+        # e.g. find(publisher=u'Apple Computer', type='apps'), every criterion must match
+        clauses = []
+        values = []
+
+        for name, value in sorted(criteria.iteritems()):
+            table, column = LOOKUPS[name]
+
+            if table is None:
+                clauses.append('entries.' + column + ' = ?')
+            else:
+                clauses.append('entries.source IN (SELECT source FROM ' + table + ' WHERE ' + column + ' = ?)')
+
+            values.append(value)
+
+        query = 'SELECT data FROM entries'
+        if clauses:
+            query += ' WHERE ' + ' AND '.join(clauses)
+        query += ' ORDER BY listYear, position'
+
+        return self.decodeRows(self.connection.execute(query, values))
+
+    def groups(self, firstYear=None, lastYear=None):
+        # (groupTitle, entries) in title order, entries in crawl order like analyze.main.
+        # Either year can be left out for no bound on that side
+        query = 'SELECT groupTitle, data FROM entries'
+        conditions = []
+        values = []
+
+        if firstYear is not None:
+            conditions.append('listYear >= ?')
+            values.append(firstYear)
+
+        if lastYear is not None:
+            conditions.append('listYear <= ?')
+            values.append(lastYear)
+
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+
+        query += ' ORDER BY groupTitle, listYear, position'
+
+        rows = self.connection.execute(query, values)
+
+        for title, titleRows in itertools.groupby(rows, lambda row: row[0]):
+            yield (title, [decoder.decode(row[1]) for row in titleRows])
+
+    def setPlacements(self, source, placements):
+        for index, placement in enumerate(placements):
+            download = placement['download']
+
+            self.connection.execute('UPDATE downloads SET directory = ?, filename = ?, minOs = ?, maxOs = ? WHERE source = ? AND position = ?',
+                (placement['directory'], placement['filename'], getattr(download, 'minOs', None), getattr(download, 'maxOs', None), source, index))
+
+    def placements(self):
+        # Same shape as entryPathToDownloads.json
+        rows = self.connection.execute('SELECT source, name, size, version, directory, filename, minOs, maxOs FROM downloads '
+            'WHERE directory IS NOT NULL ORDER BY source, position')
+
+        entryPathToDownloads = {}
+
+        for source, sourceRows in itertools.groupby(rows, lambda row: row[0]):
+            downloads = []
+
+            for row in sourceRows:
+                download = Application(row[1], row[2], row[3])
+
+                if row[6] is not None:
+                    download.minOs = row[6]
+                    download.maxOs = row[7]
+
+                downloads.append({
+                    'directory': row[4],
+                    'filename': row[5],
+                    'download': download,
+                })
+
+            entryPathToDownloads[source] = downloads
+
+        return entryPathToDownloads
+
+    def commit(self):
+        self.connection.commit()
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+def main():
+    # python catalogStore.py import [firstYear lastYear]
+    # python catalogStore.py <source|title|group|year|type|author|publisher|category> <value>
+    if len(sys.argv) < 2:
+        print 'Usage: catalogStore.py import [firstYear lastYear] | <field> <value>'
+        sys.exit(1)
+
+    catalog = CatalogStore()
+
+    if sys.argv[1] == 'import':
+        firstYear = 1984
+        lastYear = 2010
+
+        if len(sys.argv) > 3:
+            firstYear = int(sys.argv[2])
+            lastYear = int(sys.argv[3])
+
+        count = catalog.importYears(range(firstYear, lastYear + 1))
+        print 'Imported ' + str(count) + ' entries'
+    else:
+        field = sys.argv[1]
+        value = sys.argv[2].decode('utf-8')
+
+        if field == 'year':
+            value = int(value)
+
+        for entry in catalog.find(**{field: value}):
+            print entry.source + '\t' + entry.title
+
+    catalog.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+import io
+import os
+import sys
+import time
+
+from responseCache import DEFAULT_CACHE_PATH, ResponseCache
+from scrape import entrySoup, pageType, parsePageSoup
+from util import PARSERS, toJSON
+
+BASELINE = ('html5lib', False)
+# Saved entry pages, fixtures/entryPages/apps/foo.html stands for /apps/foo. Includes the cases targeted
+# parsing has to cut right: ids starting with "comments" and comments outside the game-preview's parent
+FIXTURE_DIRECTORY = 'fixtures/entryPages'
+
+def variantName(variant):
+    return variant[0] + (' (targeted)' if variant[1] else '')
+
+def parseWith(path, text, parserName, targeted):
+    try:
+        return toJSON(parsePageSoup(path, pageType(path), entrySoup(text, parserName, targeted)))
+    except Exception as e:
+        return 'Exception ' + repr(e)
+
+def compareParsers(pages):
+    variants = [(parserName, targeted) for parserName in PARSERS for targeted in (False, True)]
+    timings = dict((variant, 0.0) for variant in variants)
+    mismatches = dict((variant, []) for variant in variants)
+
+    count = 0
+    for path, text in pages:
+        results = {}
+        for variant in variants:
+            start = time.time()
+            results[variant] = parseWith(path, text, *variant)
+            timings[variant] += time.time() - start
+
+        for variant in variants:
+            if results[variant] != results[BASELINE]:
+                mismatches[variant].append(path)
+
+        count += 1
+
+    return (count, variants, timings, mismatches)
+
+def cachedEntryPages(cache):
+    for path in cache.paths():
+        if path.startswith('/year/'):
+            continue
+
+        yield (path, cache.get(path))
+
+def fixtureEntryPages(directory):
+    for root, directories, files in sorted(os.walk(directory)):
+        for name in sorted(files):
+            if not name.endswith('.html'):
+                continue
+
+            path = '/' + os.path.relpath(os.path.join(root, name[:-5]), directory).replace(os.sep, '/')
+
+            with io.open(os.path.join(root, name), encoding='utf-8') as infile:
+                yield (path, infile.read())
+
+def main():
+    # python compareParsers.py [cache] compares the fixtures, or with cache every entry page in the response cache
+    useCache = len(sys.argv) > 1 and sys.argv[1] == 'cache'
+    cache = None
+
+    if useCache:
+        cachePath = DEFAULT_CACHE_PATH
+        if len(sys.argv) > 2:
+            cachePath = sys.argv[2]
+
+        cache = ResponseCache(cachePath, offline=True)
+        pages = cachedEntryPages(cache)
+    else:
+        pages = fixtureEntryPages(FIXTURE_DIRECTORY)
+
+    count, variants, timings, mismatches = compareParsers(pages)
+
+    print 'Compared ' + str(count) + ' pages against ' + variantName(BASELINE)
+
+    identical = True
+    for variant in variants:
+        print '%-24s %8.3fs %6d mismatches' % (variantName(variant), timings[variant], len(mismatches[variant]))
+
+        for path in mismatches[variant][:10]:
+            print '    ' + path
+
+        if mismatches[variant]:
+            identical = False
+
+    if cache is not None:
+        cache.close()
+
+    if not identical:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+import sys
+import time
+
+from entry import iterYearEntries
+from filter import (ROMAN_NUMERAL_END_OF_STRING, VERSION_NUMBER, VERSION_NUMBER_END_OF_STRING, VERSION_NUMBER_RANGE,
+    VERSION_NUMBER_WITHOUT_UNDERSCORE, cleanupString, extractMultipleVersionNumbers, extractVersionNumber)
+from util import isYear, stringRemoveCenter
+
+"""
+The original chain of regex searches, kept as the reference output for the single pass lexer
+"""
+def extractVersionNumberRegex(string, includeRomanNumeral=False):
+    versionNumberMatch = VERSION_NUMBER_RANGE.search(string)
+
+    if versionNumberMatch:
+        versionNumberString = versionNumberMatch.group(1) + '-' + versionNumberMatch.group(6)
+        newString = cleanupString(stringRemoveCenter(string, versionNumberMatch.start(0), versionNumberMatch.end(0)))
+        return (versionNumberString, newString, True)
+
+    versionNumberMatch = VERSION_NUMBER_END_OF_STRING.search(string)
+
+    if versionNumberMatch:
+        versionNumberString = versionNumberMatch.group(1)
+
+        if not isYear(versionNumberString):
+            newString = cleanupString(stringRemoveCenter(string, versionNumberMatch.start(1), versionNumberMatch.end(1)))
+            return (versionNumberString.replace('_', '.'), newString, False)
+
+    versionNumberMatch = ROMAN_NUMERAL_END_OF_STRING.search(string)
+
+    if includeRomanNumeral and versionNumberMatch:
+        newString = cleanupString(stringRemoveCenter(string, versionNumberMatch.start(2), versionNumberMatch.end(2)))
+        return (versionNumberMatch.group(2), newString, False)
+
+    versionNumberMatch = VERSION_NUMBER.search(string)
+
+    if versionNumberMatch:
+        versionNumber = versionNumberMatch.group(1).replace('_', '.')
+
+        if '.' in versionNumber:
+            newString = cleanupString(stringRemoveCenter(string, versionNumberMatch.start(1), versionNumberMatch.end(1)))
+            return (versionNumber, newString, False)
+
+    return (None, string, False)
+
+def extractMultipleVersionNumbersRegex(string, withUnderscore=False):
+    pattern = VERSION_NUMBER if withUnderscore else VERSION_NUMBER_WITHOUT_UNDERSCORE
+    versionNumberMatches = pattern.findall(string)
+
+    if len(versionNumberMatches) > 0:
+        versionNumbers = []
+        for match in versionNumberMatches:
+            version = match[0]
+            if version == '68' or isYear(version):
+                continue
+
+            versionNumbers.append(version.replace('_', '.'))
+
+        return versionNumbers
+
+    return None
+
+def corpusStrings(directory):
+    strings = []
+
+    for year in range(1984, 2011):
+        for entry in iterYearEntries(year, directory):
+            if entry is None:
+                continue
+
+            strings.append(entry.title)
+
+            for download in getattr(entry, 'downloads', None) or []:
+                strings.append(download.name)
+
+    return strings
+
+def timeExtract(extract, multiple, strings, repeat):
+    start = time.time()
+
+    for i in range(repeat):
+        for string in strings:
+            extract(string, False)
+            extract(string, True)
+            multiple(string, False)
+            multiple(string, True)
+
+    return time.time() - start
+
+def main():
+    directory = 'data/'
+    if len(sys.argv) > 1:
+        directory = sys.argv[1]
+
+    repeat = 5
+
+    strings = corpusStrings(directory)
+
+    mismatches = 0
+    for string in strings:
+        for includeRomanNumeral in [False, True]:
+            if extractVersionNumberRegex(string, includeRomanNumeral) != extractVersionNumber(string, includeRomanNumeral):
+                print 'Version differs for ' + repr(string)
+                mismatches += 1
+
+        for withUnderscore in [False, True]:
+            if extractMultipleVersionNumbersRegex(string, withUnderscore) != extractMultipleVersionNumbers(string, withUnderscore):
+                print 'Version list differs for ' + repr(string)
+                mismatches += 1
+
+    regexTime = timeExtract(extractVersionNumberRegex, extractMultipleVersionNumbersRegex, strings, repeat)
+    lexerTime = timeExtract(extractVersionNumber, extractMultipleVersionNumbers, strings, repeat)
+
+    print str(len(strings)) + ' titles and download names, ' + str(repeat) + ' runs each'
+    print 'Regex chain: %.3fs' % regexTime
+    print 'Lexer: %.3fs' % lexerTime
+    print str(mismatches) + ' mismatches'
+
+    if mismatches > 0:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+import bisect
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+SECONDS_BUCKETS = [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+BYTES_BUCKETS = [1024, 5 * 1024, 10 * 1024, 25 * 1024, 50 * 1024, 100 * 1024, 250 * 1024, 500 * 1024, 1024 * 1024]
+
+class Histogram(object):
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # One extra slot for values above the last bucket (+Inf)
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.sum += other.sum
+
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or other.max > self.max):
+            self.max = other.max
+
+    def quantile(self, q):
+        # Upper bound of the bucket holding the quantile
+        if self.count < 1:
+            return None
+
+        target = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return self.buckets[index] if index < len(self.buckets) else self.max
+
+        return self.max
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'mean': self.sum / self.count if self.count > 0 else None,
+            'min': self.min,
+            'max': self.max,
+            'p50': self.quantile(0.5),
+            'p90': self.quantile(0.9),
+            'p99': self.quantile(0.99),
+            'buckets': dict(zip([str(bucket) for bucket in self.buckets] + ['+Inf'], self.counts)),
+        }
+
+lock = threading.Lock()
+histograms = {}
+counters = {}
+started = time.time()
+
+def labelKey(name, labels):
+    if labels is None:
+        return (name, ())
+
+    return (name, tuple(sorted(labels.items())))
+
+def observe(name, value, buckets=SECONDS_BUCKETS, labels=None):
+    key = labelKey(name, labels)
+
+    with lock:
+        histogram = histograms.get(key)
+
+        if histogram is None:
+            histogram = Histogram(buckets)
+            histograms[key] = histogram
+
+        histogram.observe(value)
+
+def increment(name, labels=None, value=1):
+    key = labelKey(name, labels)
+
+    with lock:
+        counters[key] = counters.get(key, 0) + value
+
+@contextmanager
+def timer(name, labels=None):
+    start = time.time()
+
+    try:
+        yield
+    finally:
+        observe(name, time.time() - start, labels=labels)
+
+def reset():
+    global started
+
+    with lock:
+        histograms.clear()
+        counters.clear()
+        started = time.time()
+
+def snapshot():
+    with lock:
+        return (dict(histograms), dict(counters))
+
+def merge(snapshotData):
+    otherHistograms, otherCounters = snapshotData
+
+    with lock:
+        for key, other in otherHistograms.iteritems():
+            histogram = histograms.get(key)
+
+            if histogram is None:
+                histogram = Histogram(other.buckets)
+                histograms[key] = histogram
+
+            histogram.merge(other)
+
+        for key, value in otherCounters.iteritems():
+            counters[key] = counters.get(key, 0) + value
+
+def formatKey(key):
+    name, labels = key
+
+    if not labels:
+        return name
+
+    return name + '{' + ','.join(label + '="' + str(value) + '"' for label, value in labels) + '}'
+
+def summary():
+    elapsed = time.time() - started
+
+    with lock:
+        requests = sum(value for key, value in counters.iteritems() if key[0] == 'requests_total')
+        responseBytes = sum(histogram.sum for key, histogram in histograms.iteritems() if key[0] == 'response_bytes')
+
+        return {
+            'elapsedSeconds': elapsed,
+            'requestsPerSecond': requests / elapsed if elapsed > 0 else None,
+            'bytesPerSecond': responseBytes / elapsed if elapsed > 0 else None,
+            'counters': dict((formatKey(key), value) for key, value in counters.iteritems()),
+            'histograms': dict((formatKey(key), histogram.summary()) for key, histogram in histograms.iteritems()),
+        }
+
+def prometheusLabels(labels, extra=None):
+    pairs = list(labels)
+
+    if extra is not None:
+        pairs.append(extra)
+
+    if not pairs:
+        return ''
+
+    return '{' + ','.join(label + '="' + str(value) + '"' for label, value in pairs) + '}'
+
+def prometheusText(prefix='crawl_'):
+    lines = []
+
+    with lock:
+        for name in sorted(set(key[0] for key in counters)):
+            lines.append('# TYPE ' + prefix + name + ' counter')
+
+            for key in sorted(key for key in counters if key[0] == name):
+                lines.append(prefix + name + prometheusLabels(key[1]) + ' ' + str(counters[key]))
+
+        for name in sorted(set(key[0] for key in histograms)):
+            lines.append('# TYPE ' + prefix + name + ' histogram')
+
+            for key in sorted(key for key in histograms if key[0] == name):
+                histogram = histograms[key]
+
+                cumulative = 0
+                for index, count in enumerate(histogram.counts):
+                    cumulative += count
+                    bound = str(histogram.buckets[index]) if index < len(histogram.buckets) else '+Inf'
+                    lines.append(prefix + name + '_bucket' + prometheusLabels(key[1], ('le', bound)) + ' ' + str(cumulative))
+
+                lines.append(prefix + name + '_sum' + prometheusLabels(key[1]) + ' ' + repr(histogram.sum))
+                lines.append(prefix + name + '_count' + prometheusLabels(key[1]) + ' ' + str(histogram.count))
+
+    return '\n'.join(lines) + '\n'
+
+def export(name='metrics'):
+    with open(name + '.json', 'w') as outfile:
+        json.dump(summary(), outfile, indent=2, sort_keys=True)
+
+    with open(name + '.prom', 'w') as outfile:
+        outfile.write(prometheusText())
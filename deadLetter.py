@@ -0,0 +1,32 @@
+import sqlite3
+import time
+
+DEFAULT_DEAD_LETTER_PATH = 'data/deadLetter.db'
+
+class DeadLetterStore(object):
+    def __init__(self, path=DEFAULT_DEAD_LETTER_PATH):
+        self.connection = sqlite3.connect(path, timeout=60)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS failures (url TEXT PRIMARY KEY, kind TEXT, year TEXT, error TEXT, attempts INTEGER, lastAttempt REAL)')
+        self.connection.commit()
+
+    def add(self, url, kind, year, error, attempts):
+        row = self.connection.execute('SELECT attempts FROM failures WHERE url = ?', (url,)).fetchone()
+
+        if row is not None:
+            attempts += row[0]
+
+        self.connection.execute('INSERT OR REPLACE INTO failures VALUES (?, ?, ?, ?, ?, ?)', (url, kind, year, error, attempts, time.time()))
+        self.connection.commit()
+
+    def remove(self, url):
+        self.connection.execute('DELETE FROM failures WHERE url = ?', (url,))
+        self.connection.commit()
+
+    def failures(self, year):
+        return self.connection.execute('SELECT url, kind, error, attempts FROM failures WHERE year = ? ORDER BY lastAttempt', (year,)).fetchall()
+
+    def years(self):
+        return [row[0] for row in self.connection.execute('SELECT DISTINCT year FROM failures ORDER BY year')]
+
+    def close(self):
+        self.connection.close()
@@ -1,15 +1,77 @@
+import cPickle
+import cStringIO
+import gc
 import json
-from util import hasKeys
+import os
+from contextlib import contextmanager
+from util import TYPE_KEY, hasKeys, openCompressed
 
 ENTRY_KEYS = ['source', 'title', 'type']
 APPLICATION_KEYS = ['name', 'size', 'version']
 RATING_KEYS = ['average', 'count']
 
+# In order of preference when several exist for the same year
+ENTRY_FILE_EXTENSIONS = ['.jsonl.zst', '.jsonl.gz', '.jsonl', '.json']
+
+SNAPSHOT_EXTENSION = '.snapshot'
+# Bump when the models change shape so stale snapshots are rebuilt
+SNAPSHOT_VERSION = 1
+
+# Marks a slot that was never assigned
+UNSET = object()
+
 class JSONInitable(object):
+    # Fixed slots instead of a per-object __dict__. Optional fields are left
+    # unset until assigned so hasattr() still tells whether they were present
+    __slots__ = ()
+
     def __init__(self, json):
-        self.__dict__ = json
+        for key, value in json.iteritems():
+            setattr(self, key, value)
+
+    def toDict(self):
+        dictionary = {}
+
+        for key in self.__slots__:
+            value = getattr(self, key, UNSET)
+
+            if value is not UNSET:
+                dictionary[key] = value
+
+        return dictionary
+
+    def __copy__(self):
+        # Much quicker than copy's generic __reduce_ex__ path
+        instance = self.__class__.__new__(self.__class__)
+
+        for key in self.__slots__:
+            value = getattr(self, key, UNSET)
+
+            if value is not UNSET:
+                setattr(instance, key, value)
+
+        return instance
+
+    def __getstate__(self):
+        return self.toDict()
+
+    def __setstate__(self, state):
+        for key, value in state.iteritems():
+            setattr(self, key, value)
+
+    @classmethod
+    def fromDict(cls, dictionary):
+        instance = cls.__new__(cls)
+
+        for key in dictionary:
+            setattr(instance, key, dictionary[key])
+
+        return instance
 
 class Entry(JSONInitable):
+    __slots__ = ('source', 'title', 'type', 'category', 'year', 'author', 'publisher', 'description', 'architecture',
+        'rating', 'compatibilityText', 'downloads', 'manuals', 'version', 'versionRange')
+
     def __init__(self, source, title, typeString, category, year, author, publisher, description, architecture):
         self.source = source
         self.title = title
@@ -22,17 +84,36 @@ class Entry(JSONInitable):
         self.architecture = architecture
 
 class Application(JSONInitable):
+    __slots__ = ('name', 'size', 'version', 'minOs', 'maxOs')
+
     def __init__(self, name, size, versionString):
         self.name = name
         self.size = size
         self.version = versionString
 
 class Rating(JSONInitable):
+    __slots__ = ('average', 'count')
+
     def __init__(self, average, count):
         self.average = average
         self.count = count
 
+ENTRY_TYPES = {
+    'Entry': Entry,
+    'Application': Application,
+    'Rating': Rating,
+}
+
 def jsonDecode(dictionary):
+    typeName = dictionary.pop(TYPE_KEY, None)
+
+    if typeName is not None:
+        return ENTRY_TYPES[typeName].fromDict(dictionary)
+
+    # Files written before type tags were added
+    return decodeUntagged(dictionary)
+
+def decodeUntagged(dictionary):
     if hasKeys(dictionary, ENTRY_KEYS):
         entry = Entry(dictionary.get('source'), dictionary.get('title'), dictionary.get('type'), dictionary.get('category'),
             dictionary.get('year'), dictionary.get('author'), dictionary.get('publisher'), dictionary.get('description'), dictionary.get('architecture'))
@@ -67,6 +148,98 @@ def jsonDecode(dictionary):
     
     return dictionary
 
-def loadEntries(name):
-    with open(name, 'r') as infile:
-        return json.load(infile, object_hook=jsonDecode)
+decoder = json.JSONDecoder(object_hook=jsonDecode)
+
+@contextmanager
+def collectionPaused():
+    # Loading allocates hundreds of thousands of containers, and none of them
+    # are garbage, so repeated cyclic collections are pure overhead
+    enabled = gc.isenabled()
+    gc.disable()
+
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+def loadEntries(name, snapshot=False):
+    if snapshot:
+        return loadSnapshotted(name, lambda: loadEntries(name))
+
+    with open(name, 'r') as infile, collectionPaused():
+        return decoder.decode(infile.read())
+
+def iterEntries(name):
+    if name.endswith('.json'):
+        for entry in loadEntries(name):
+            yield entry
+        return
+
+    with openCompressed(name, 'r') as infile:
+        for line in infile:
+            line = line.strip()
+
+            if line:
+                yield decoder.decode(line)
+
+def yearEntriesPath(year, directory='data/'):
+    for extension in ENTRY_FILE_EXTENSIONS:
+        name = directory + str(year) + extension
+
+        if os.path.isfile(name):
+            return name
+
+    return None
+
+def iterYearEntries(year, directory='data/'):
+    name = yearEntriesPath(year, directory)
+
+    if name is None:
+        return iter([])
+
+    return iterEntries(name)
+
+def loadYearEntries(year, directory='data/', snapshot=False):
+    name = yearEntriesPath(year, directory)
+
+    if name is None:
+        return []
+
+    if snapshot:
+        return loadSnapshotted(name, lambda: loadYearEntries(year, directory))
+
+    with collectionPaused():
+        return list(iterEntries(name))
+
+def sourceSignature(name):
+    stat = os.stat(name)
+
+    return (SNAPSHOT_VERSION, stat.st_size, stat.st_mtime)
+
+def loadSnapshotted(name, load):
+    snapshotName = name + SNAPSHOT_EXTENSION
+    signature = sourceSignature(name)
+
+    if os.path.isfile(snapshotName):
+        try:
+            with open(snapshotName, 'rb') as infile:
+                # cPickle reads plain files in tiny chunks, cStringIO is much faster
+                snapshot = cStringIO.StringIO(infile.read())
+
+            with collectionPaused():
+                if cPickle.load(snapshot) == signature:
+                    return cPickle.load(snapshot)
+        except (EOFError, cPickle.UnpicklingError, AttributeError, ValueError):
+            # Truncated or from an older layout, rebuild below
+            pass
+
+    data = load()
+
+    temporaryName = snapshotName + '.tmp'
+    with open(temporaryName, 'wb') as outfile, collectionPaused():
+        cPickle.dump(signature, outfile, cPickle.HIGHEST_PROTOCOL)
+        cPickle.dump(data, outfile, cPickle.HIGHEST_PROTOCOL)
+    os.rename(temporaryName, snapshotName)
+
+    return data
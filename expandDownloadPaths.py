@@ -13,8 +13,9 @@ def extractRootFolderNames(paths):
 def main():
     archiveRoot = 'Y:/Downloads/complete/'
     useFilename = False
+    useSnapshots = True
 
-    entryPathToDownloads = loadEntries('entryPathToDownloads.json')
+    entryPathToDownloads = loadEntries('entryPathToDownloads.json', useSnapshots)
 
     outputPaths = []
     
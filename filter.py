@@ -1,6 +1,7 @@
 import re
 
-from util import isYear, stringRemoveCenter, stripMultipleSpaces, stripStringFromString
+from memoize import memoize
+from util import isYear, stringRemoveCenter, stripMultipleSpaces, stripPattern, stripStringFromString
 
 EXTENSION_END_OF_STRING_VERSION_NUMBER = r'(\.[_a-z]*)*$'
 VERSION_NUMBER_START = r'(([0-9]|\.(?=[0-9])|v(?=[0-9]))([0-9]|[.'
@@ -19,12 +20,20 @@ ARCHITECTURE = re.compile(r'(ppc|(?<![0-9])68k?)')
 STRIP_PERIOD_SPACES = re.compile(r'(\s*\.\s*)')
 STRIP_PARENS = re.compile(r'(\([a-z0-9./ -\'"]*\))', re.IGNORECASE)
 
+# Kinds of version number candidates
+RANGE_VERSION = 'range'
+END_VERSION = 'end'
+ROMAN_VERSION = 'roman'
+INLINE_VERSION = 'inline'
+
 STRIPPABLE_WORDS = ['macintosh', 'version', 'inc.', 'inc', 'incorporated', 'corp', 'volume', 'aka', 'the', 'an',
     'a', 'is', '&', '%', '$', '#', '@', 'and', 'or', 'of', 'in', 'for']
+STRIPPABLE_PATTERNS = [(strippable, stripPattern(strippable)) for strippable in STRIPPABLE_WORDS]
 
 def cleanupString(string):
     return stripPeriodSpaces(stripMultipleSpaces(string)).strip()
 
+@memoize()
 def stripBetweenParens(string):
     if len(string) > 31:
         # Attempt to strip between parens
@@ -58,18 +67,25 @@ def stripStringsFromString(stringsList, string):
 
     return string
 
+@memoize()
 def stripStringsFromStringIfNeeded(stringsList, string):
     if len(string) > 31:
         return stripStringsFromString(stringsList, string)
 
     return string
 
+@memoize()
 def stripStrippableWords(string):
     if len(string) > 31:
         # Attempt to strip unneeded words
         newString = string
-        for strippable in STRIPPABLE_WORDS:
-            newString = cleanupString(stripStringFromString(strippable, newString))
+        lowerString = None
+        for strippable, pattern in STRIPPABLE_PATTERNS:
+            # Once cleaned up, a word that doesn't appear would leave the string as it is
+            if lowerString is None or strippable in lowerString:
+                newString = cleanupString(pattern.sub(' ', newString))
+                lowerString = newString.lower()
+
             if len(newString) <= 31:
                 # Short circuit before removing all words if not necessary
                 break
@@ -100,64 +116,100 @@ def stripFirstWords(string, stringWithSpaces):
     
     return string
 
-def extractVersionNumber(string, includeRomanNumeral=False):
-    versionNumberMatch = VERSION_NUMBER_RANGE.search(string)
+def lexVersionNumbers(string, withUnderscore=True):
+    # One scan for every version number in the string, as (kind, start, end, text) candidates.
+    # The same matches as VERSION_NUMBER(_WITHOUT_UNDERSCORE).findall
+    pattern = VERSION_NUMBER if withUnderscore else VERSION_NUMBER_WITHOUT_UNDERSCORE
 
-    if versionNumberMatch:
-        versionNumberStart = versionNumberMatch.group(1)
-        versionNumberEnd = versionNumberMatch.group(6)
+    return [(INLINE_VERSION, match.start(1), match.end(1), match.group(1)) for match in pattern.finditer(string)]
 
-        newString = cleanupString(stringRemoveCenter(string, versionNumberMatch.start(0), versionNumberMatch.end(0)))
+def searchFrom(token):
+    # A "v" taken as the trailing letter of the previous token can also start this one,
+    # any other earlier start can't reach past the previous token
+    return max(token[1] - 1, 0)
 
-        return (versionNumberStart + '-' + versionNumberEnd, newString, True)
+def findVersionRange(string, tokens):
+    # Same match as VERSION_NUMBER_RANGE.search, only tried from the first token with a separator
+    # right after it, or inside it for "_", since no earlier one can start a range
+    if '-' not in string and '_' not in string and '&' not in string:
+        return None
 
-    versionNumberMatch = VERSION_NUMBER_END_OF_STRING.search(string)
+    for token in tokens:
+        following = string[token[1] + 1:token[2] + 2]
+
+        if '-' in following or '_' in following or '&' in following:
+            return VERSION_NUMBER_RANGE.search(string, searchFrom(token))
+
+    return None
 
-    if versionNumberMatch:
-        versionNumberString = versionNumberMatch.group(1)
-        if not isYear(versionNumberString):
-            # Any underscores should be periods instead
-            versionNumber = versionNumberString.replace('_', '.')
-            # Strip version number from filename
-            newString = cleanupString(stringRemoveCenter(string, versionNumberMatch.start(1), versionNumberMatch.end(1)))
+def findVersionAtEnd(string, tokens):
+    # Same match as VERSION_NUMBER_END_OF_STRING.search. Trailing extensions hold no digits,
+    # so only the last token can reach them
+    if not tokens:
+        return None
 
-            return (versionNumber, newString, False)
+    return VERSION_NUMBER_END_OF_STRING.search(string, searchFrom(tokens[-1]))
 
-    # Check for Roman numerals at end of string
-    versionNumberMatch = ROMAN_NUMERAL_END_OF_STRING.search(string)
+def versionCandidates(string, includeRomanNumeral=False):
+    # Every (kind, start, end, text) candidate from a single lexVersionNumbers scan, in the order
+    # extractVersionNumber prefers them. Generated lazily, the later kinds are often never needed
+    tokens = lexVersionNumbers(string)
 
-    if includeRomanNumeral and versionNumberMatch:
-        versionNumber = versionNumberMatch.group(2)
+    rangeMatch = findVersionRange(string, tokens)
+    if rangeMatch:
+        yield (RANGE_VERSION, rangeMatch.start(0), rangeMatch.end(0), rangeMatch.group(1) + '-' + rangeMatch.group(6))
+
+    endMatch = findVersionAtEnd(string, tokens)
+    if endMatch:
+        yield (END_VERSION, endMatch.start(1), endMatch.end(1), endMatch.group(1))
+
+    if includeRomanNumeral:
+        romanNumeralMatch = ROMAN_NUMERAL_END_OF_STRING.search(string)
+        if romanNumeralMatch:
+            yield (ROMAN_VERSION, romanNumeralMatch.start(2), romanNumeralMatch.end(2), romanNumeralMatch.group(2))
+
+    for token in tokens:
+        yield token
+
+@memoize()
+def extractVersionNumber(string, includeRomanNumeral=False):
+    for kind, start, end, text in versionCandidates(string, includeRomanNumeral):
+        if kind == RANGE_VERSION:
+            newString = cleanupString(stringRemoveCenter(string, start, end))
 
-        newString = cleanupString(stringRemoveCenter(string, versionNumberMatch.start(2), versionNumberMatch.end(2)))
+            return (text, newString, True)
+        elif kind == END_VERSION:
+            if not isYear(text):
+                # Any underscores should be periods instead
+                versionNumber = text.replace('_', '.')
+                # Strip version number from filename
+                newString = cleanupString(stringRemoveCenter(string, start, end))
 
-        return (versionNumber, newString, False)
+                return (versionNumber, newString, False)
+        elif kind == ROMAN_VERSION:
+            newString = cleanupString(stringRemoveCenter(string, start, end))
 
-    # Check without being at end of string
-    versionNumberMatch = VERSION_NUMBER.search(string)
+            return (text, newString, False)
+        else:
+            # Without being at end of string only the first one counts
+            versionNumber = text.replace('_', '.')
 
-    if versionNumberMatch:
-        versionNumberString = versionNumberMatch.group(1).replace('_', '.')
+            if '.' in versionNumber:
+                # Decimal must be present in version number if it's not at the end of the line
+                newString = cleanupString(stringRemoveCenter(string, start, end))
 
-        if '.' in versionNumberString:
-            # Decimal must be present in version number if it's not at the end of the line
-            versionNumber = versionNumberString
-            newString = cleanupString(stringRemoveCenter(string, versionNumberMatch.start(1), versionNumberMatch.end(1)))
+                return (versionNumber, newString, False)
 
-            return (versionNumber, newString, False)
+            break
 
     return (None, string, False)
 
 def extractMultipleVersionNumbers(string, withUnderscore=False):
-    if withUnderscore:
-        versionNumberMatches = VERSION_NUMBER.findall(string)
-    else:
-        versionNumberMatches = VERSION_NUMBER_WITHOUT_UNDERSCORE.findall(string)
+    tokens = lexVersionNumbers(string, withUnderscore)
 
-    if len(versionNumberMatches) > 0:
+    if len(tokens) > 0:
         versionNumbers = []
-        for match in versionNumberMatches:
-            version = match[0]
+        for kind, start, end, version in tokens:
             if version == '68' or isYear(version):
                 continue
 
@@ -167,6 +219,7 @@ def extractMultipleVersionNumbers(string, withUnderscore=False):
 
     return None
 
+@memoize()
 def extractArchitecture(string):
     architectureMatch = ARCHITECTURE.search(string)
 
@@ -1,13 +1,32 @@
+import multiprocessing
+import os
 import requests
+import shutil
+import socket
 import sys
-import time
+import zlib
 from bs4 import BeautifulSoup, NavigableString
+from multiprocessing.pool import ThreadPool
 
-from scrape import parsePage
-from util import compact, getSoupFromPath, save
+import crawlMetrics
+import rateLimit
+from deadLetter import DeadLetterStore
+from entry import ENTRY_FILE_EXTENSIONS, decoder, iterEntries, iterYearEntries, yearEntriesPath
+from frontier import FAILED, Frontier, NAV, PAGE
+from pageState import PageState, contentHash
+from parsePipeline import ParserPool
+from responseCache import ResponseCache
+from scrape import parseHtml, parsePage
+from util import JsonLinesWriter, compact, getConditional, getPageText, getSoupFromPath, openCompressed, save, setParser, setResponseCache, toJSON, tryCall
+from workQueue import Heartbeat, LeaseLostError, WorkQueue
 
-def scanForUrls(path):
-    soup = getSoupFromPath(path)
+# Entries are streamed to data/<year><extension> as they are parsed. '.jsonl.zst' needs the zstandard package
+OUTPUT_EXTENSION = '.jsonl.gz'
+# Entries are written uncompressed while crawling and compressed when the year is published
+PARTIAL_EXTENSION = '.partial.jsonl'
+
+def scanForUrls(path, fresh=False):
+    soup = getSoupFromPath(path, fresh)
 
     newPages = compact([extractUrl(element) for element in soup.find_all('h2')])
     newNavs = compact([extractUrl(element) for element in soup.find_all(class_='pager-item')])
@@ -22,67 +41,485 @@ def extractUrl(domElement):
 
     return element.get('href')
 
-def downloadYear(year):
-    yearString = str(year)
+def quarantine(deadLetters, frontier, yearString, url, kind, error, attempts):
+    print 'Quarantining ' + url + ' after ' + str(attempts) + ' attempts: ' + error.strip().splitlines()[-1]
 
-    examineUrl = '/year/' + yearString
+    deadLetters.add(url, kind, yearString, error, attempts)
+    frontier.markFailed(url)
+    frontier.checkpoint()
+
+def crawlNavs(yearString, frontier, deadLetters, pool, fresh=False):
+    # fresh fetches the nav pages past the response cache, so new and removed entries show up
     limit = -1
 
-    navUrls = {}
-    pageUrls = {}
+    count = 0
+    while (frontier.hasPending(NAV) and (limit == -1 or count < limit)):
+        pendingNavs = frontier.popAll(NAV)
+
+        if limit != -1:
+            pendingNavs = pendingNavs[:limit - count]
 
-    navUrls[examineUrl] = False
+        for url, result, error, attempts in pool.imap(lambda path: tryCall(scanForUrls, path, fresh), pendingNavs):
+            if error is not None:
+                quarantine(deadLetters, frontier, yearString, url, NAV, error, attempts)
+                continue
 
-    newNavExamined = True
-    count = 0
-    while (newNavExamined and (limit == -1 or count < limit)):
-        newNavExamined = False
-        for url, examined in navUrls.iteritems():
-            if not examined:
-                time.sleep(2)
-                try:
-                    newPages, newNavs = scanForUrls(url)
-                except:
-                    print 'Exception occured ' + sys.exc_info()[0]
-                    break
-
-                for page in newPages:
-                    if not page in pageUrls:
-                        print 'Adding page ' + page
-                        pageUrls[page] = False
-
-                for nav in newNavs:
-                    if not nav in navUrls:
-                        print 'Adding nav ' + nav
-                        navUrls[nav] = False
-
-                navUrls[url] = True
-                newNavExamined = True
-                break
-
-        count += 1
+            newPages, newNavs = result
+
+            for page in newPages:
+                if frontier.add(page, PAGE):
+                    print 'Adding page ' + page
+
+            for nav in newNavs:
+                if frontier.add(nav, NAV):
+                    print 'Adding nav ' + nav
+
+            frontier.markDone(url)
+            frontier.checkpoint()
+
+            count += 1
 
     print 'Examined ' + str(count) + ' nav pages'
 
-    entries = []
+def downloadPages(yearString, frontier, deadLetters, output, pool, concurrency, parsers):
+    paths = frontier.popAll(PAGE)
+
+    if parsers is not None:
+        results = parsers.parse(paths, getPageText, concurrency)
+    else:
+        results = pool.imap(lambda path: tryCall(parsePage, path), paths)
+
+    for path, entry, error, attempts in results:
+        if error is not None:
+            quarantine(deadLetters, frontier, yearString, path, PAGE, error, attempts)
+            continue
+
+        output.write(entry)
+        frontier.markDone(path)
+        frontier.checkpoint()
+
+def refreshPage(path, validators, previousEntry):
+    etag, lastModified, previousHash = validators
+
+    if previousEntry is None:
+        # Nothing to reuse, force a full download
+        etag = None
+        lastModified = None
+
+    response = getConditional(path, etag, lastModified)
+
+    if response.status_code == 304:
+        return (previousEntry, validators)
+
+    if response.status_code != 200:
+        # An error page isn't the entry's content, quarantine it rather than parse or hash it
+        raise requests.HTTPError(str(response.status_code) + ' for ' + path, response=response)
+
+    text = response.text
+    newValidators = (response.headers.get('ETag'), response.headers.get('Last-Modified'), contentHash(text))
+
+    if previousEntry is not None and newValidators[2] == previousHash:
+        return (previousEntry, newValidators)
+
+    return (parseHtml(path, text), newValidators)
+
+def loadPreviousEntries(yearString):
+    previousEntries = {}
+
+    for entry in iterYearEntries(yearString):
+        if entry is not None:
+            previousEntries[entry.source] = entry
+
+    return previousEntries
+
+def refreshPages(yearString, frontier, deadLetters, output, pool, previousEntries):
+    state = PageState()
+
+    work = [(path, state.get(path), previousEntries.get(path)) for path in frontier.popAll(PAGE)]
+
+    for path, result, error, attempts in pool.imap(lambda item: tryCall(refreshPage, *item), work):
+        if error is not None:
+            quarantine(deadLetters, frontier, yearString, path, PAGE, error, attempts)
+            continue
+
+        entry, validators = result
+        state.put(path, *validators)
+        state.commit()
+
+        output.write(entry)
+        frontier.markDone(path)
+        frontier.checkpoint()
+
+    state.close()
+
+def navsComplete(frontier):
+    # Without every nav page the page list is partial, missing pages say nothing about removals
+    return len(frontier.urls(NAV, FAILED)) == 0
+
+def carryForward(frontier, output, previousEntries):
+    # Entries that couldn't be checked this time are kept as they were instead of dropped from the year
+    if navsComplete(frontier):
+        sources = frontier.urls(PAGE, FAILED)
+    else:
+        sources = sorted(previousEntries)
+
+    for source in sources:
+        if source in previousEntries:
+            output.write(previousEntries[source])
+
+def saveDelta(yearString, previousEntries, entries, pageUrls, complete=True):
+    added = []
+    changed = []
+
+    for entry in entries:
+        if entry is None:
+            continue
+
+        previousEntry = previousEntries.get(entry.source)
+
+        if previousEntry is None:
+            added.append(entry)
+        elif toJSON(previousEntry) != toJSON(entry):
+            changed.append(entry)
+
+    if complete:
+        removed = sorted(set(previousEntries) - pageUrls)
+    else:
+        print 'Some nav pages failed, not reporting removed applications'
+        removed = []
+
+    save({'added': added, 'changed': changed, 'removed': removed}, 'data/' + yearString + '.delta.json')
+
+    print 'Added ' + str(len(added)) + ', changed ' + str(len(changed)) + ', removed ' + str(len(removed)) + ' applications'
+
+class YearOutput(object):
+    def __init__(self, yearString, resume=False):
+        self.yearString = yearString
+        self.name = 'data/' + yearString + OUTPUT_EXTENSION
+        # Plain JSON Lines next to the previous output, which stays readable until the crawl finishes.
+        # Every line is on disk once written, a compressed stream would only be readable once closed
+        self.partialName = 'data/' + yearString + PARTIAL_EXTENSION
+        # What earlier versions wrote the partial output as, still read when resuming
+        self.compressedPartialName = 'data/' + yearString + '.partial' + OUTPUT_EXTENSION
+        self.sources = set()
+        # Set by worker mode, stops writing as soon as another worker has taken the year over
+        self.heartbeat = None
+
+        entries = []
+
+        if resume:
+            entries = self.completeEntries(self.partialName) + self.completeEntries(self.compressedPartialName)
+
+        # Rewritten with only the complete lines, so new ones aren't appended to one cut off by a crash.
+        # Renamed into place once done, the frontier already counts these pages as crawled
+        rewriteName = self.partialName + '.rewrite'
+        self.writer = JsonLinesWriter(rewriteName, 'w')
+
+        for entry in entries:
+            self.write(entry)
+
+        os.rename(rewriteName, self.partialName)
+
+        if os.path.isfile(self.compressedPartialName):
+            os.remove(self.compressedPartialName)
+
+    def completeEntries(self, name):
+        # The entries written before the crawl was interrupted, up to the first line it cut off
+        entries = []
+
+        if not os.path.isfile(name):
+            return entries
 
-    for path in pageUrls:
-        time.sleep(2)
         try:
-            entry = parsePage(path)
-        except:
-            print 'Exception occured ' + sys.exc_info()[0]
+            with openCompressed(name, 'r') as infile:
+                for line in infile:
+                    if not line.endswith('\n'):
+                        break
+
+                    if line.strip():
+                        entries.append(decoder.decode(line))
+        except (IOError, EOFError, ValueError, zlib.error):
+            # A truncated gzip stream or line, everything before it is still good
+            pass
+
+        return entries
+
+    def write(self, entry):
+        if entry is None or entry.source in self.sources:
+            return
+
+        if self.heartbeat is not None:
+            self.heartbeat.check()
+
+        self.sources.add(entry.source)
+        self.writer.write(entry)
+
+    def close(self):
+        self.writer.close()
+
+    def publish(self):
+        # Compressed under a temporary name, then replaces the previous output for this year, whatever format it was in
+        publishName = 'data/' + self.yearString + '.publish' + OUTPUT_EXTENSION
+
+        with open(self.partialName, 'rb') as infile:
+            outfile = openCompressed(publishName, 'w')
+            shutil.copyfileobj(infile, outfile)
+            outfile.close()
+
+        for extension in ENTRY_FILE_EXTENSIONS:
+            name = 'data/' + self.yearString + extension
+            if os.path.isfile(name):
+                os.remove(name)
+
+        os.rename(publishName, self.name)
+        os.remove(self.partialName)
+
+def frontierPath(yearString):
+    return 'data/' + yearString + '.frontier.db'
+
+def downloadYear(year, concurrency=1, incremental=False, parsers=None, heartbeat=None):
+    # parsers is a ParserPool, without one pages are parsed in the fetch threads.
+    # heartbeat is the lease a worker holds on the year, LeaseLostError is raised once it is gone
+    yearString = str(year)
+
+    # Picks up where a previous, interrupted crawl of this year stopped
+    frontierName = frontierPath(yearString)
+    resume = os.path.isfile(frontierName)
+    frontier = Frontier(frontierName)
+    frontier.add('/year/' + yearString, NAV)
+    frontier.checkpoint()
+
+    output = YearOutput(yearString, resume)
+    output.heartbeat = heartbeat
+    deadLetters = DeadLetterStore()
+    pool = ThreadPool(concurrency)
+
+    try:
+        # The year listings an incremental refresh compares against must be today's, not the cache's
+        crawlNavs(yearString, frontier, deadLetters, pool, incremental)
+
+        if heartbeat is not None:
+            heartbeat.check()
+
+        if incremental:
+            previousEntries = loadPreviousEntries(yearString)
+            refreshPages(yearString, frontier, deadLetters, output, pool, previousEntries)
+            carryForward(frontier, output, previousEntries)
+        else:
+            downloadPages(yearString, frontier, deadLetters, output, pool, concurrency, parsers)
+
+        if heartbeat is not None:
+            heartbeat.check()
+    except LeaseLostError:
+        # Left to the worker that holds the year now
+        pool.terminate()
+        pool.join()
+        deadLetters.close()
+        output.close()
+        frontier.close()
+        raise
+
+    pool.terminate()
+    pool.join()
+    deadLetters.close()
+    output.close()
+
+    print 'Downloaded ' + str(len(output.sources)) + ' applications'
+
+    if frontier.pendingCount() > 0:
+        # Keep the checkpoint and partial output so the next run resumes instead of starting over
+        frontier.close()
+        return
+
+    output.publish()
+
+    if incremental:
+        saveDelta(yearString, previousEntries, iterEntries(output.name), set(frontier.urls(PAGE)), navsComplete(frontier))
+
+    frontier.remove()
+
+def replayFailures(year, concurrency=1):
+    yearString = str(year)
+
+    # An interrupted crawl keeps its entries in the partial output, which replaying would overwrite
+    # while the checkpoint still has those pages marked done
+    if os.path.isfile(frontierPath(yearString)):
+        print 'Not replaying ' + yearString + ', finish its interrupted crawl first'
+        return
+
+    deadLetters = DeadLetterStore()
+    failures = deadLetters.failures(yearString)
+
+    if len(failures) < 1:
+        print 'No quarantined pages for ' + yearString
+        deadLetters.close()
+        return
+
+    name = yearEntriesPath(yearString)
+    sources = set()
+    if name is not None:
+        sources = set(entry.source for entry in iterEntries(name) if entry is not None)
+
+    navs = [url for url, kind, error, attempts in failures if kind == NAV]
+    pages = [url for url, kind, error, attempts in failures if kind == PAGE]
+
+    pool = ThreadPool(concurrency)
+
+    if navs:
+        # Crawled like a fresh year from the recovered nav pages, so pager pages only they link to are found too
+        frontier = Frontier(':memory:')
+
+        for url in navs:
+            frontier.add(url, NAV)
+
+        crawlNavs(yearString, frontier, deadLetters, pool)
+
+        failedNavs = set(frontier.urls(NAV, FAILED))
+
+        for url in navs:
+            if url not in failedNavs:
+                deadLetters.remove(url)
+
+        for page in frontier.urls(PAGE):
+            if page not in sources and page not in pages:
+                print 'Adding page ' + page
+                pages.append(page)
+
+        frontier.close()
+
+    recoveredEntries = {}
+    for path, entry, error, attempts in pool.imap(lambda path: tryCall(parsePage, path), pages):
+        if error is not None:
+            deadLetters.add(path, PAGE, yearString, error, attempts)
+            continue
+
+        deadLetters.remove(path)
+        recoveredEntries[path] = entry
+
+    pool.terminate()
+    pool.join()
+
+    # Stream the existing entries into a new file, swapping in the recovered ones
+    output = YearOutput(yearString)
+
+    if name is not None:
+        for entry in iterEntries(name):
+            if entry is not None and entry.source in recoveredEntries:
+                entry = recoveredEntries.pop(entry.source)
+
+            output.write(entry)
+
+    for path in pages:
+        if path in recoveredEntries:
+            output.write(recoveredEntries[path])
+
+    output.close()
+    output.publish()
+
+    print 'Recovered ' + str(len(recoveredEntries)) + ' applications, ' + str(len(deadLetters.failures(yearString))) + ' still quarantined'
+
+    deadLetters.close()
+
+def runWorker(years, concurrency, incremental, parsers, restart=False):
+    queue = WorkQueue()
+    queue.enqueue(years, restart)
+
+    owner = socket.gethostname() + ':' + str(os.getpid())
+
+    while True:
+        year = queue.claim(owner)
+
+        if year is None:
             break
 
-        entries.append(entry)
+        print 'Worker ' + owner + ' claimed ' + str(year)
 
-    save(entries, 'data/' + yearString + '.json')
+        heartbeat = Heartbeat(queue.path, year, owner)
+        heartbeat.start()
 
-    print 'Downloaded ' + str(len(entries)) + ' applications'
+        try:
+            # A year whose previous owner died resumes from its frontier checkpoint
+            downloadYear(year, concurrency, incremental, parsers, heartbeat)
+        except LeaseLostError:
+            heartbeat.stop()
+            print 'Stopped ' + str(year) + ', another worker took it over'
+            continue
+        except:
+            heartbeat.stop()
+            queue.release(year, owner)
+            raise
+
+        heartbeat.stop()
+
+        if not queue.complete(year, owner):
+            print 'Lease on ' + str(year) + ' expired before it finished, another worker will redo it'
+
+    print 'No work left, ' + str(queue.remaining()) + ' years still leased by other workers'
+
+    if queue.doneCount() > 0 and not restart:
+        print str(queue.doneCount()) + ' years were already done, run with restart to crawl them again'
+
+    queue.close()
 
 def main():
-    for year in range(1996, 2001):
-        downloadYear(year)
+    # Re-parse previously downloaded pages without touching the network
+    offline = False
+    # Only re-parse entry pages that changed since the last crawl
+    incremental = False
+    # Only retry pages quarantined by earlier crawls
+    replay = False
+    # Entry pages are parsed in this many worker processes, 0 parses in the fetch threads
+    processes = multiprocessing.cpu_count()
+    # Claim years from data/workQueue.db alongside other workers, which may run on other machines sharing data/
+    worker = len(sys.argv) > 1 and sys.argv[1] == 'worker'
+    # Number of workers crawling at once, the politeness budget is split between them
+    workerCount = 1
+    if len(sys.argv) > 2:
+        workerCount = int(sys.argv[2])
+    # Queue years already done in data/workQueue.db again, e.g. for the next full crawl
+    restart = 'restart' in sys.argv[3:]
+
+    years = range(1996, 2001)
+
+    # Politeness budget against macintoshgarden.org, shared by all fetch threads and split between workers.
+    # The rate and the number of requests in flight back off on slow responses and errors, and recover
+    # up to the budget but never past it
+    requestsPerSecond = 2.0
+    rateLimit.setRateLimit(requestsPerSecond / workerCount, 5, adaptive=True, maxRate=requestsPerSecond / workerCount)
+    # Only switch backends once compareParsers.py reports no mismatches on the fixtures and the cached pages
+    setParser('html5lib', targeted=False)
+
+    # Forked now, before the response cache's connection or any fetch thread exists
+    parsers = None
+    if processes > 0 and not incremental and not replay:
+        parsers = ParserPool(processes)
+
+    setResponseCache(ResponseCache(ttl=30 * 24 * 60 * 60, offline=offline))
+
+    try:
+        if worker:
+            runWorker(years, 8, incremental, parsers, restart)
+        else:
+            for year in years:
+                if replay:
+                    replayFailures(year, 8)
+                else:
+                    downloadYear(year, 8, incremental, parsers)
+    except:
+        if parsers is not None:
+            parsers.terminate()
+        raise
+
+    if parsers is not None:
+        # Merges the parsers' metrics into this process's
+        parsers.close()
+
+    metricsName = 'data/metrics'
+    if worker:
+        metricsName += '-' + socket.gethostname() + '-' + str(os.getpid())
+
+    crawlMetrics.export(metricsName)
+    save(rateLimit.rateHistory(), metricsName + '-rates.json')
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,74 @@
+import collections
+import os
+import sqlite3
+
+NAV = 'nav'
+PAGE = 'page'
+
+PENDING = 'pending'
+DONE = 'done'
+FAILED = 'failed'
+
+class Frontier(object):
+    def __init__(self, path):
+        self.path = path
+        # Waits for other processes' writes instead of failing with "database is locked"
+        self.connection = sqlite3.connect(path, timeout=60)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS urls (id INTEGER PRIMARY KEY AUTOINCREMENT, url TEXT UNIQUE, kind TEXT, status TEXT)')
+        self.connection.commit()
+
+        self.seen = set()
+        self.queues = {NAV: collections.deque(), PAGE: collections.deque()}
+
+        # Rebuild in-memory state from the last checkpoint, in discovery order
+        for url, kind, status in self.connection.execute('SELECT url, kind, status FROM urls ORDER BY id'):
+            self.seen.add(url)
+
+            if status == PENDING:
+                self.queues[kind].append(url)
+
+    def add(self, url, kind):
+        if url in self.seen:
+            return False
+
+        self.seen.add(url)
+        self.queues[kind].append(url)
+        self.connection.execute('INSERT INTO urls (url, kind, status) VALUES (?, ?, ?)', (url, kind, PENDING))
+
+        return True
+
+    def popAll(self, kind):
+        queue = self.queues[kind]
+        urls = list(queue)
+        queue.clear()
+
+        return urls
+
+    def hasPending(self, kind):
+        return len(self.queues[kind]) > 0
+
+    def pendingCount(self):
+        return self.connection.execute('SELECT COUNT(*) FROM urls WHERE status = ?', (PENDING,)).fetchone()[0]
+
+    def urls(self, kind, status=None):
+        if status is None:
+            return [row[0] for row in self.connection.execute('SELECT url FROM urls WHERE kind = ? ORDER BY id', (kind,))]
+
+        return [row[0] for row in self.connection.execute('SELECT url FROM urls WHERE kind = ? AND status = ? ORDER BY id', (kind, status))]
+
+    def markDone(self, url):
+        self.connection.execute('UPDATE urls SET status = ? WHERE url = ?', (DONE, url))
+
+    def markFailed(self, url):
+        self.connection.execute('UPDATE urls SET status = ? WHERE url = ?', (FAILED, url))
+
+    def checkpoint(self):
+        self.connection.commit()
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+    def remove(self):
+        self.connection.close()
+        os.remove(self.path)
@@ -0,0 +1,121 @@
+import functools
+
+# Results kept per function before the least recently used ones are dropped
+DEFAULT_MAX_SIZE = 10000
+
+# Link fields of the recently used list
+PREVIOUS, NEXT, KEY, RESULT = 0, 1, 2, 3
+
+# Turns every memoized function back into a plain call, e.g. to measure without it
+enabled = True
+
+memoizedFunctions = []
+
+def setMemoizeEnabled(value):
+    global enabled
+    enabled = value
+
+def freezeArgument(value):
+    # Author and publisher lists are passed around, keys need hashable values
+    if isinstance(value, list):
+        return tuple(freezeArgument(item) for item in value)
+
+    return value
+
+class Memoized(object):
+    def __init__(self, function, maxSize):
+        functools.update_wrapper(self, function)
+        # Lets analyzeCache.codeHash see through to the function itself
+        self.__wrapped__ = function
+
+        self.function = function
+        self.maxSize = maxSize
+        self.results = {}
+        # Circular doubly linked list through the results, least recently used first
+        self.root = []
+        self.root[:] = [self.root, self.root, None, None]
+        self.hits = 0
+        self.misses = 0
+
+        memoizedFunctions.append(self)
+
+    def __call__(self, *args):
+        if not enabled:
+            return self.function(*args)
+
+        key = args
+        try:
+            link = self.results.get(key)
+        except TypeError:
+            key = tuple(freezeArgument(arg) for arg in args)
+            link = self.results.get(key)
+
+        root = self.root
+
+        if link is not None:
+            self.hits += 1
+
+            # Move to the most recently used end
+            previousLink, nextLink, linkKey, result = link
+            previousLink[NEXT] = nextLink
+            nextLink[PREVIOUS] = previousLink
+
+            last = root[PREVIOUS]
+            last[NEXT] = root[PREVIOUS] = link
+            link[PREVIOUS] = last
+            link[NEXT] = root
+
+            return result
+
+        self.misses += 1
+        result = self.function(*args)
+
+        if len(self.results) >= self.maxSize:
+            oldest = root[NEXT]
+            root[NEXT] = oldest[NEXT]
+            oldest[NEXT][PREVIOUS] = root
+            del self.results[oldest[KEY]]
+
+        last = root[PREVIOUS]
+        link = [last, root, key, result]
+        last[NEXT] = root[PREVIOUS] = self.results[key] = link
+
+        return result
+
+    def clear(self):
+        self.results.clear()
+        self.root[:] = [self.root, self.root, None, None]
+
+def memoize(maxSize=DEFAULT_MAX_SIZE):
+    # Only for pure functions whose arguments are hashable, or lists of hashable values
+    def decorate(function):
+        return Memoized(function, maxSize)
+
+    return decorate
+
+def takeMemoizeStats():
+    # {function name: (hits, misses)} since the last call, for merging into the parent's counts
+    stats = {}
+
+    for memoized in memoizedFunctions:
+        stats[memoized.__name__] = (memoized.hits, memoized.misses)
+        memoized.hits = 0
+        memoized.misses = 0
+
+    return stats
+
+def mergeMemoizeStats(stats):
+    for memoized in memoizedFunctions:
+        hits, misses = stats.get(memoized.__name__, (0, 0))
+        memoized.hits += hits
+        memoized.misses += misses
+
+def printMemoizeStats():
+    for memoized in memoizedFunctions:
+        calls = memoized.hits + memoized.misses
+
+        if calls == 0:
+            continue
+
+        print 'Memoized %s: %d hits, %d misses (%.0f%% hit rate)' % (memoized.__name__, memoized.hits, memoized.misses,
+            100.0 * memoized.hits / calls)
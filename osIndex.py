@@ -0,0 +1,165 @@
+import array
+import re
+import sqlite3
+import sys
+
+from catalogStore import CatalogStore
+from entry import loadEntries
+
+DEFAULT_OS_INDEX_PATH = 'data/osIndex.db'
+
+OS_NUMBER = re.compile(r'([0-9]+(\.[0-9]+)?|x)', re.IGNORECASE)
+
+# Which downloads run on exactly a segment's start, or on anything between it and the next one
+AT_START = 0
+AFTER_START = 1
+
+SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS downloads (id INTEGER PRIMARY KEY, source TEXT, position INTEGER, name TEXT, directory TEXT, filename TEXT, minOs REAL, maxOs REAL)',
+    'CREATE TABLE IF NOT EXISTS segments (start REAL, kind INTEGER, ids BLOB, PRIMARY KEY (start, kind))',
+]
+
+def osNumber(osVersion):
+    # "7.5.3" -> 7.5, "X" -> 10, the same scale as analyze.osVersionRange
+    osMatch = OS_NUMBER.search(osVersion)
+
+    if osMatch is None:
+        return None
+
+    osString = osMatch.group(1)
+
+    if osString.lower() == 'x':
+        return 10.0
+
+    return float(osString)
+
+def packIds(ids):
+    return sqlite3.Binary(array.array('i', ids).tostring())
+
+def unpackIds(blob):
+    ids = array.array('i')
+    ids.fromstring(str(blob))
+
+    return ids
+
+class OsIndex(object):
+    # Every distinct minOs/maxOs value starts two segments, one for the value itself and one for the
+    # gap up to the next value. Each holds the ids of the downloads that cover it, so a query is at
+    # most two primary key lookups for the segment holding the version asked for
+    def __init__(self, path=DEFAULT_OS_INDEX_PATH):
+        self.connection = sqlite3.connect(path, timeout=60)
+
+        for statement in SCHEMA:
+            self.connection.execute(statement)
+
+        self.connection.commit()
+
+    def build(self, entryPathToDownloads):
+        # entryPathToDownloads as analyze.main saves it, or CatalogStore.placements
+        self.connection.execute('DELETE FROM downloads')
+        self.connection.execute('DELETE FROM segments')
+
+        intervals = []
+
+        for source in sorted(entryPathToDownloads):
+            for position, placement in enumerate(entryPathToDownloads[source]):
+                download = placement['download']
+                minOs = getattr(download, 'minOs', None)
+                maxOs = getattr(download, 'maxOs', None)
+
+                if minOs is None or maxOs is None:
+                    continue
+
+                downloadId = len(intervals) + 1
+                intervals.append((minOs, maxOs, downloadId))
+
+                self.connection.execute('INSERT INTO downloads VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    (downloadId, source, position, download.name, placement['directory'], placement['filename'], minOs, maxOs))
+
+        self.connection.executemany('INSERT INTO segments VALUES (?, ?, ?)', self.sweep(intervals))
+        self.connection.commit()
+
+        return len(intervals)
+
+    def sweep(self, intervals):
+        # One pass over the endpoints in order, keeping the downloads that cover the current one
+        starting = sorted(intervals)
+        ending = sorted(intervals, key=lambda interval: interval[1])
+        endpoints = sorted(set(interval[0] for interval in intervals) | set(interval[1] for interval in intervals))
+
+        active = set()
+        startIndex = 0
+        endIndex = 0
+
+        for endpoint in endpoints:
+            while startIndex < len(starting) and starting[startIndex][0] == endpoint:
+                active.add(starting[startIndex][2])
+                startIndex += 1
+
+            yield (endpoint, AT_START, packIds(sorted(active)))
+
+            while endIndex < len(ending) and ending[endIndex][1] == endpoint:
+                active.discard(ending[endIndex][2])
+                endIndex += 1
+
+            yield (endpoint, AFTER_START, packIds(sorted(active)))
+
+    def downloadIds(self, version):
+        row = self.connection.execute('SELECT ids FROM segments WHERE start = ? AND kind = ?', (version, AT_START)).fetchone()
+
+        if row is None:
+            # Between two endpoints, covered by whatever covers the gap after the lower one
+            row = self.connection.execute('SELECT ids FROM segments WHERE start < ? AND kind = ? ORDER BY start DESC LIMIT 1',
+                (version, AFTER_START)).fetchone()
+
+        if row is None:
+            return []
+
+        return unpackIds(row[0])
+
+    def runsOn(self, version):
+        # (source, name, directory, filename, minOs, maxOs) for every download whose range covers version
+        results = []
+
+        for downloadId in self.downloadIds(version):
+            results.append(self.connection.execute('SELECT source, name, directory, filename, minOs, maxOs FROM downloads WHERE id = ?',
+                (downloadId,)).fetchone())
+
+        return results
+
+    def close(self):
+        self.connection.close()
+
+def main():
+    # python osIndex.py build [catalog]
+    # python osIndex.py <os version, e.g. 7.5.3>
+    if len(sys.argv) < 2:
+        print 'Usage: osIndex.py build [catalog] | <os version>'
+        sys.exit(1)
+
+    index = OsIndex()
+
+    if sys.argv[1] == 'build':
+        if len(sys.argv) > 2 and sys.argv[2] == 'catalog':
+            catalog = CatalogStore()
+            entryPathToDownloads = catalog.placements()
+            catalog.close()
+        else:
+            entryPathToDownloads = loadEntries('entryPathToDownloads.json')
+
+        count = index.build(entryPathToDownloads)
+        print 'Indexed ' + str(count) + ' downloads'
+    else:
+        version = osNumber(sys.argv[1])
+
+        if version is None:
+            print 'Unknown OS version ' + sys.argv[1]
+            sys.exit(1)
+
+        for source, name, directory, filename, minOs, maxOs in index.runsOn(version):
+            print source + '\t' + name + '\t' + directory + filename + '\t' + str(minOs) + '-' + str(maxOs)
+
+    index.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,32 @@
+import hashlib
+import sqlite3
+import time
+
+DEFAULT_STATE_PATH = 'data/pageState.db'
+
+def contentHash(text):
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+class PageState(object):
+    def __init__(self, path=DEFAULT_STATE_PATH):
+        self.connection = sqlite3.connect(path, timeout=60)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS pages (path TEXT PRIMARY KEY, etag TEXT, lastModified TEXT, hash TEXT, checked REAL)')
+        self.connection.commit()
+
+    def get(self, path):
+        row = self.connection.execute('SELECT etag, lastModified, hash FROM pages WHERE path = ?', (path,)).fetchone()
+
+        if row is None:
+            return (None, None, None)
+
+        return row
+
+    def put(self, path, etag, lastModified, hash):
+        self.connection.execute('INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?)', (path, etag, lastModified, hash, time.time()))
+
+    def commit(self):
+        self.connection.commit()
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
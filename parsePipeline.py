@@ -0,0 +1,141 @@
+import multiprocessing
+import threading
+import traceback
+import Queue
+
+import crawlMetrics
+import util
+from scrape import parseHtml
+from util import setParser, tryCall
+
+DEFAULT_QUEUE_SIZE = 64
+# How often a wait on the workers checks they are still running
+LIVENESS_SECONDS = 5
+
+def parseWorker(htmlQueue, resultQueue, metricsQueue, parserName, targeted):
+    # Worker processes don't share the parent's settings on every platform
+    setParser(parserName, targeted)
+    # Forked workers start with a copy of the parent's metrics
+    crawlMetrics.reset()
+
+    while True:
+        item = htmlQueue.get()
+
+        if item is None:
+            metricsQueue.put(crawlMetrics.snapshot())
+            break
+
+        path, html, attempts = item
+
+        try:
+            resultQueue.put((path, parseHtml(path, html), None, attempts))
+        except:
+            resultQueue.put((path, None, traceback.format_exc(), attempts))
+
+def fetchWorker(pathQueue, htmlQueue, resultQueue, fetch, stopped, sent):
+    while not stopped.is_set():
+        try:
+            path = pathQueue.get_nowait()
+        except Queue.Empty:
+            return
+
+        path, html, error, attempts = tryCall(fetch, path)
+
+        # Counted before it is queued, so the consumer never thinks it has everything too early
+        with sent['lock']:
+            sent['count'] += 1
+
+        if error is not None:
+            resultQueue.put((path, None, error, attempts))
+        else:
+            # Blocks while the parsers are behind, keeping memory flat
+            htmlQueue.put((path, html, attempts))
+
+class ParserPool(object):
+    # Parser processes kept for the whole crawl. Start it before any thread or sqlite connection
+    # exists: the workers are forked, and a fork copies held locks and open connections with them
+    def __init__(self, processes=None, queueSize=DEFAULT_QUEUE_SIZE):
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+
+        self.htmlQueue = multiprocessing.Queue(queueSize)
+        self.resultQueue = multiprocessing.Queue(queueSize)
+        self.metricsQueue = multiprocessing.Queue()
+
+        self.parsers = [multiprocessing.Process(target=parseWorker, args=(self.htmlQueue, self.resultQueue, self.metricsQueue, util.htmlParser, util.targetedParsing))
+            for i in range(processes)]
+        for parser in self.parsers:
+            parser.daemon = True
+            parser.start()
+
+    def checkAlive(self):
+        for parser in self.parsers:
+            if not parser.is_alive():
+                raise RuntimeError('Parser process ' + str(parser.pid) + ' exited with code ' + str(parser.exitcode))
+
+    def nextResult(self):
+        # A dead parser would otherwise leave this waiting forever for its result
+        while True:
+            try:
+                return self.resultQueue.get(timeout=LIVENESS_SECONDS)
+            except Queue.Empty:
+                self.checkAlive()
+
+    def parse(self, paths, fetch, fetchers=1):
+        # Yields (path, entry, error, attempts) for every path, in the order they finish
+        pathQueue = Queue.Queue()
+        for path in paths:
+            pathQueue.put(path)
+
+        count = pathQueue.qsize()
+        stopped = threading.Event()
+        sent = {'lock': threading.Lock(), 'count': 0}
+        received = 0
+
+        fetchThreads = [threading.Thread(target=fetchWorker, args=(pathQueue, self.htmlQueue, self.resultQueue, fetch, stopped, sent)) for i in range(fetchers)]
+        for thread in fetchThreads:
+            thread.daemon = True
+            thread.start()
+
+        try:
+            while received < count:
+                result = self.nextResult()
+                received += 1
+                yield result
+        finally:
+            # Stopped early: let the fetches under way finish and drop their results,
+            # so the next year starts with empty queues
+            stopped.set()
+
+            while received < sent['count'] or any(thread.is_alive() for thread in fetchThreads):
+                try:
+                    self.resultQueue.get(timeout=LIVENESS_SECONDS)
+                    received += 1
+                except Queue.Empty:
+                    self.checkAlive()
+
+    def close(self):
+        for parser in self.parsers:
+            self.htmlQueue.put(None)
+
+        try:
+            snapshots = 0
+
+            while snapshots < len(self.parsers):
+                try:
+                    crawlMetrics.merge(self.metricsQueue.get(timeout=LIVENESS_SECONDS))
+                    snapshots += 1
+                except Queue.Empty:
+                    # Parsers that reported have exited, only give up once none is left to report
+                    if not any(parser.is_alive() for parser in self.parsers):
+                        raise RuntimeError(str(len(self.parsers) - snapshots) + ' parser processes exited without reporting metrics')
+
+            for parser in self.parsers:
+                parser.join()
+        finally:
+            self.terminate()
+
+    def terminate(self):
+        for parser in self.parsers:
+            if parser.is_alive():
+                parser.terminate()
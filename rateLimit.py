@@ -0,0 +1,189 @@
+import email.utils
+import threading
+import time
+from urlparse import urlparse
+
+DEFAULT_REQUESTS_PER_SECOND = 0.5
+DEFAULT_BURST = 1
+
+# Adaptive (AIMD) limits
+MIN_REQUESTS_PER_SECOND = 0.2
+MIN_CONCURRENCY = 1
+MAX_CONCURRENCY = 16
+ADDITIVE_INCREASE = 0.1
+MULTIPLICATIVE_DECREASE = 0.5
+# Responses slower than this are treated as the origin struggling
+SLOW_RESPONSE_SECONDS = 3
+# Give the last cut time to take effect before cutting again
+DECREASE_COOLDOWN_SECONDS = 5
+# Only log increases once the rate has grown by this factor
+LOG_GROWTH = 1.25
+HISTORY_INTERVAL_SECONDS = 1
+
+class TokenBucket(object):
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.updated = time.time()
+        self.lock = threading.Lock()
+
+    def refill(self, now):
+        elapsed = now - self.updated
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.updated = now
+
+    def setRate(self, rate):
+        with self.lock:
+            self.refill(time.time())
+            self.rate = float(rate)
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.time()
+                self.refill(now)
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                wait = (1 - self.tokens) / self.rate
+
+            time.sleep(wait)
+
+class HostLimiter(object):
+    def __init__(self, host, rate, capacity, adaptive, maxRate):
+        self.host = host
+        self.bucket = TokenBucket(rate, capacity)
+        self.adaptive = adaptive
+        # Increases never go past the configured budget, only back up to it after a cut
+        self.maxRate = maxRate
+        self.minRate = min(MIN_REQUESTS_PER_SECOND, maxRate)
+        self.concurrency = float(MIN_CONCURRENCY) if adaptive else None
+        self.inFlight = 0
+        self.pausedUntil = 0
+        self.lastDecrease = 0
+        self.loggedRate = rate
+        self.history = [(time.time(), rate, self.concurrency)]
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while True:
+                wait = self.pausedUntil - time.time()
+
+                if wait > 0:
+                    self.condition.wait(wait)
+                elif self.concurrency is not None and self.inFlight >= int(self.concurrency):
+                    self.condition.wait()
+                else:
+                    break
+
+            self.inFlight += 1
+
+        self.bucket.acquire()
+
+        return time.time()
+
+    def release(self, started, status=None, retryAfter=None):
+        latency = time.time() - started
+
+        with self.condition:
+            self.inFlight -= 1
+
+            if retryAfter is not None:
+                self.pausedUntil = max(self.pausedUntil, time.time() + retryAfter)
+                print 'Pausing ' + self.host + ' for ' + str(retryAfter) + 's (Retry-After)'
+
+            if self.adaptive:
+                congested = status is None or status == 429 or status >= 500 or latency > SLOW_RESPONSE_SECONDS
+                self.adjust(started, congested)
+
+            self.condition.notify_all()
+
+    def adjust(self, started, congested):
+        rate = self.bucket.rate
+
+        if congested:
+            if started < self.lastDecrease + DECREASE_COOLDOWN_SECONDS:
+                return
+
+            self.lastDecrease = time.time()
+            rate = max(self.minRate, rate * MULTIPLICATIVE_DECREASE)
+            self.concurrency = max(MIN_CONCURRENCY, self.concurrency * MULTIPLICATIVE_DECREASE)
+        else:
+            # Grows by roughly ADDITIVE_INCREASE req/s for every second of healthy responses
+            rate = min(self.maxRate, rate + ADDITIVE_INCREASE / rate)
+            self.concurrency = min(MAX_CONCURRENCY, self.concurrency + 1 / self.concurrency)
+
+        self.bucket.setRate(rate)
+
+        now = time.time()
+        if congested or now - self.history[-1][0] >= HISTORY_INTERVAL_SECONDS:
+            self.history.append((now, rate, self.concurrency))
+
+        if congested or rate >= self.loggedRate * LOG_GROWTH:
+            self.loggedRate = rate
+            print 'Rate for ' + self.host + ' now %.2f req/s, %d in flight' % (rate, int(self.concurrency))
+
+requestsPerSecond = DEFAULT_REQUESTS_PER_SECOND
+maxRequestsPerSecond = DEFAULT_REQUESTS_PER_SECOND
+burst = DEFAULT_BURST
+adaptiveLimits = False
+
+limiters = {}
+limitersLock = threading.Lock()
+
+def setRateLimit(rate, capacity=DEFAULT_BURST, adaptive=False, maxRate=None):
+    # maxRate caps adaptive increases, by default the starting rate is the whole budget
+    global requestsPerSecond, maxRequestsPerSecond, burst, adaptiveLimits
+
+    with limitersLock:
+        requestsPerSecond = rate
+        maxRequestsPerSecond = maxRate if maxRate is not None else rate
+        burst = capacity
+        adaptiveLimits = adaptive
+        # Existing limiters pick up the new budget on next use
+        limiters.clear()
+
+def limiterForHost(host):
+    with limitersLock:
+        limiter = limiters.get(host)
+
+        if limiter is None:
+            limiter = HostLimiter(host, requestsPerSecond, burst, adaptiveLimits, maxRequestsPerSecond)
+            limiters[host] = limiter
+
+        return limiter
+
+def acquire(url):
+    limiter = limiterForHost(urlparse(url).netloc)
+
+    return (limiter, limiter.acquire())
+
+def release(ticket, status=None, retryAfter=None):
+    limiter, started = ticket
+    limiter.release(started, status, parseRetryAfter(retryAfter))
+
+def parseRetryAfter(value):
+    if value is None:
+        return None
+
+    value = value.strip()
+
+    if value.isdigit():
+        return int(value)
+
+    # Otherwise an HTTP date
+    parsed = email.utils.parsedate_tz(value)
+
+    if parsed is None:
+        return None
+
+    return max(0, email.utils.mktime_tz(parsed) - time.time())
+
+def rateHistory():
+    with limitersLock:
+        return dict((host, limiter.history) for host, limiter in limiters.iteritems())
@@ -0,0 +1,82 @@
+import sqlite3
+import threading
+import time
+import zlib
+
+DEFAULT_CACHE_PATH = 'cache.db'
+# 2GB of compressed HTML
+DEFAULT_MAX_SIZE = 2 * 1024 * 1024 * 1024
+
+class CacheMissError(Exception):
+    pass
+
+class ResponseCache(object):
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl=None, maxSize=DEFAULT_MAX_SIZE, offline=False):
+        self.ttl = ttl
+        self.maxSize = maxSize
+        self.offline = offline
+        self.lock = threading.Lock()
+
+        self.connection = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS responses (path TEXT PRIMARY KEY, fetched REAL, accessed REAL, size INTEGER, body BLOB)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS responsesAccessed ON responses (accessed)')
+        self.connection.commit()
+
+        self.totalSize = self.connection.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+    def isExpired(self, fetched):
+        return self.ttl is not None and not self.offline and time.time() - fetched > self.ttl
+
+    def get(self, path):
+        with self.lock:
+            row = self.connection.execute('SELECT fetched, body FROM responses WHERE path = ?', (path,)).fetchone()
+
+            if row is None:
+                return None
+
+            fetched, body = row
+
+            if self.isExpired(fetched):
+                return None
+
+            self.connection.execute('UPDATE responses SET accessed = ? WHERE path = ?', (time.time(), path))
+            self.connection.commit()
+
+        return zlib.decompress(body).decode('utf-8')
+
+    def put(self, path, text):
+        body = zlib.compress(text.encode('utf-8'))
+        now = time.time()
+
+        with self.lock:
+            row = self.connection.execute('SELECT size FROM responses WHERE path = ?', (path,)).fetchone()
+            if row is not None:
+                self.totalSize -= row[0]
+
+            self.connection.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)', (path, now, now, len(body), sqlite3.Binary(body)))
+            self.totalSize += len(body)
+
+            self.evict()
+            self.connection.commit()
+
+    def evict(self):
+        if self.maxSize is None:
+            return
+
+        # Drop least recently used pages until under the size limit
+        while self.totalSize > self.maxSize:
+            row = self.connection.execute('SELECT path, size FROM responses ORDER BY accessed LIMIT 1').fetchone()
+
+            if row is None:
+                break
+
+            self.connection.execute('DELETE FROM responses WHERE path = ?', (row[0],))
+            self.totalSize -= row[1]
+
+    def paths(self):
+        with self.lock:
+            return [row[0] for row in self.connection.execute('SELECT path FROM responses ORDER BY path')]
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -1,23 +1,71 @@
+import re
 from bs4 import BeautifulSoup, NavigableString
 
+import crawlMetrics
+import util
 from entry import Entry, Application, Rating
-from util import compact, concatStringsWithSpace, convertNone, firstOrNone, getSoupFromPath
+from util import compact, convertNone, firstOrNone, getPageText, needsSpace, soupFromText
 
 STRINGLESS_CLASSES = set(['download'])
 NEWLINE_TAGS = set(['p', 'br'])
 TEXT_TAGS = set(['a', 'i', 'b', 'strong'])
 
-def parsePage(path):
+NEWLINE_GROUP = 1
+TEXT_GROUP = 2
+OTHER_GROUP = 3
+
+COMMENTS_TAG = re.compile(r'<[^<>]*\bid\s*=\s*["\']?comments(?=["\'\s>])')
+
+def pageType(path):
     pathList = path.split('/')
 
     if len(pathList) < 2:
         print 'Invalid URL'
         return None
 
-    typeString = pathList[1]
+    return pathList[1]
+
+def parsePage(path):
+    if pageType(path) is None:
+        return None
+
+    return parseHtml(path, getPageText(path))
+
+def parseHtml(path, html):
+    typeString = pageType(path)
+
+    if typeString is None:
+        return None
+
+    with crawlMetrics.timer('parse_page_seconds'):
+        return parsePageSoup(path, typeString, entrySoup(html))
+
+def entrySubtree(text):
+    # Everything parsePage reads lies in the body before the comments. Cutting any later than the
+    # body's start would drop the opening tags of the elements around the title, and the parser
+    # would then make their later content siblings of the game-preview
+    start = text.find('<body')
+
+    if start < 0:
+        start = 0
+
+    end = COMMENTS_TAG.search(text, start)
+
+    if end is None:
+        return text[start:]
 
-    soup = getSoupFromPath(path)
+    return text[start:end.start()]
 
+def entrySoup(text, parserName=None, targeted=None):
+    if targeted is None:
+        targeted = util.targetedParsing
+
+    if targeted:
+        text = entrySubtree(text)
+
+    return soupFromText(text, parserName)
+
+def parsePageSoup(path, typeString, soup):
     h1Title = soup.find('h1')
     if h1Title is None:
         return None
@@ -108,82 +156,130 @@ def parseDescriptionAndCompatability(soup):
                 # End of section
                 break
 
-            foundStrings.extend(flattenAndCombineStringTags(element))
-        
+            flattenInto(element, foundStrings)
+
         element = element.nextSibling
 
     compatibility = False
-    firstDescription = True
-    firstCompatibility = True
 
-    description = ''
+    descriptionStrings = []
     architecture = ''
-    compatibilityText = ''
+    compatibilityStrings = []
 
     for string in foundStrings:
         string = string.strip()
 
-        isCompatibility = False
         if not compatibility and string == 'Compatibility':
-            isCompatibility = True
             compatibility = True
+            continue
 
         if compatibility:
             if string.startswith('Architecture:'):
                 architecture = string[13:].strip()
             else:
-                if not firstCompatibility:
-                    compatibilityText += '\n'
-                if not isCompatibility:
-                    compatibilityText += string
-                    firstCompatibility = False
+                compatibilityStrings.append(string)
         else:
-            if not firstDescription:
-                description += '\n'
-            description += string
-            firstDescription = False
+            descriptionStrings.append(string)
+
+    return ('\n'.join(descriptionStrings), architecture, '\n'.join(compatibilityStrings))
 
-    return (description, architecture, compatibilityText)
+def isStringless(domElement):
+    classes = domElement.get('class')
+
+    return classes is not None and any(className in STRINGLESS_CLASSES for className in classes)
+
+def appendWithSpace(parts, string):
+    if len(string) < 1:
+        return
+
+    if parts and needsSpace(parts[-1][-1], string[0]):
+        parts.append(' ')
+
+    parts.append(string)
+
+def flushString(parts, foundStrings):
+    if parts:
+        foundStrings.append(''.join(parts))
+        del parts[:]
 
 def flattenAndCombineStringTags(domElement):
     foundStrings = []
-    currentString = ''
+    flattenInto(domElement, foundStrings)
 
-    if domElement.get('class') and any(className in STRINGLESS_CLASSES for className in domElement.get('class')):
+    return foundStrings
+
+"""
+Iterative walk that appends the combined strings of domElement to foundStrings. The current, not yet
+finished string of each open tag is kept as a list of parts and only joined once it is complete.
+"""
+def flattenInto(domElement, foundStrings):
+    if isStringless(domElement):
         # Skip this element
-        return []
+        return
 
-    # Recursively examine current tag
-    for element in domElement.children:
-        if isinstance(element, NavigableString):
-            currentString = concatStringsWithSpace(currentString, unicode(element))
-        elif element.get('class') and any(className in STRINGLESS_CLASSES for className in element.get('class')):
-            # Skip this element
-            break
-        elif element.name in NEWLINE_TAGS:
-            if currentString != '':
-                foundStrings.append(currentString)
-                currentString = ''
-            foundStrings.extend(flattenAndCombineStringTags(element))
-        elif element.name in TEXT_TAGS:
-            strings = flattenAndCombineStringTags(element)
-            length = len(strings)
-            if length > 1:
-                # Use formatting provided by lower level
-                if currentString != '':
-                    foundStrings.append(currentString)
-                    currentString = ''
-                foundStrings.extend(strings)
-            elif length == 1:
-                currentString = concatStringsWithSpace(currentString, strings[0])
+    # Each frame is [children iterator, tag group, start of its strings, placeholder index, current string parts]
+    stack = [[iter(domElement.contents), None, len(foundStrings), -1, []]]
+
+    while stack:
+        frame = stack[-1]
+        parts = frame[4]
+
+        child = None
+        for element in frame[0]:
+            if isinstance(element, NavigableString):
+                appendWithSpace(parts, unicode(element))
+            elif not isStringless(element):
+                child = element
+                break
+            else:
+                # Skip this element and the rest of its siblings
+                break
+
+        if child is None:
+            stack.pop()
+            finishFrame(frame, stack, foundStrings)
+            continue
+
+        name = child.name
+        placeholder = -1
+
+        if name in NEWLINE_TAGS:
+            group = NEWLINE_GROUP
+            flushString(parts, foundStrings)
+        elif name in TEXT_TAGS:
+            group = TEXT_GROUP
+            if parts:
+                # Reserve a slot in case the text tag turns out to contain multiple strings
+                placeholder = len(foundStrings)
+                foundStrings.append(None)
         else:
-            foundStrings.extend(flattenAndCombineStringTags(element))
+            group = OTHER_GROUP
+
+        stack.append([iter(child.contents), group, len(foundStrings), placeholder, []])
 
+def finishFrame(frame, stack, foundStrings):
     # Save last string
-    if currentString != '':
-        foundStrings.append(currentString)
+    flushString(frame[4], foundStrings)
 
-    return foundStrings
+    if frame[1] != TEXT_GROUP:
+        return
+
+    start = frame[2]
+    placeholder = frame[3]
+    parentParts = stack[-1][4]
+    length = len(foundStrings) - start
+
+    if length > 1:
+        # Use formatting provided by lower level
+        if placeholder > -1:
+            foundStrings[placeholder] = ''.join(parentParts)
+            del parentParts[:]
+    else:
+        strings = foundStrings[start:]
+        del foundStrings[start if placeholder < 0 else placeholder:]
+
+        if length == 1:
+            appendWithSpace(parentParts, strings[0])
 
 def extractString(domElement, tagName, index=-1, recursive=True):
     if domElement is None:
@@ -0,0 +1,432 @@
+import hashlib
+import heapq
+import math
+import re
+import sqlite3
+import sys
+import time
+
+from entry import iterYearEntries
+
+DEFAULT_TEXT_INDEX_PATH = 'data/textIndex.db'
+
+TOKEN = re.compile(r'\w+', re.UNICODE)
+# A quoted phrase or a single word
+QUERY_PART = re.compile(r'"([^"]*)"|(\S+)')
+
+# Indexed entry fields and how much a match in each counts towards the score
+FIELDS = [('title', 3.0), ('compatibilityText', 1.5), ('description', 1.0)]
+
+# Words in so many entries that phrases with them are indexed as word pairs, the usual
+# English ones and those every other entry's description or compatibility text has.
+# The index has to be built again from scratch after changing them
+COMMON_WORDS = frozenset([
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'has', 'have', 'in', 'is', 'it', 'its', 'of', 'on', 'or',
+    'that', 'the', 'this', 'to', 'was', 'with', 'you', 'your',
+    'game', 'mac', 'macintosh', 'os', 'system', 'version',
+])
+
+# Okapi BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+DEFAULT_RESULT_COUNT = 20
+
+# Most "?" parameters sqlite takes in one statement
+SQL_VARIABLE_LIMIT = 999
+
+SCHEMA = [
+    # terms is every term id in the document, for removing its postings again
+    'CREATE TABLE IF NOT EXISTS documents (id INTEGER PRIMARY KEY, source TEXT UNIQUE, title TEXT, length INTEGER, signature TEXT, terms BLOB)',
+    'CREATE TABLE IF NOT EXISTS terms (id INTEGER PRIMARY KEY, term TEXT UNIQUE)',
+    # Clustered by term so each query term is one range scan. frequency is the field weighted count,
+    # positions holds field, count and delta encoded positions for each field the term is in, as varints
+    'CREATE TABLE IF NOT EXISTS postings (term INTEGER, document INTEGER, frequency REAL, positions BLOB, '
+        'PRIMARY KEY (term, document)) WITHOUT ROWID',
+]
+
+def tokenize(text):
+    if not text:
+        return []
+
+    return TOKEN.findall(text.lower())
+
+def packVarints(numbers):
+    numbers = list(numbers)
+
+    if max(numbers or [0]) < 0x80:
+        return sqlite3.Binary(str(bytearray(numbers)))
+
+    data = bytearray()
+
+    for number in numbers:
+        while number >= 0x80:
+            data.append((number & 0x7f) | 0x80)
+            number >>= 7
+
+        data.append(number)
+
+    return sqlite3.Binary(str(data))
+
+def unpackVarints(blob):
+    data = bytearray(blob)
+
+    # Positions and term gaps mostly fit a byte each, then there is nothing to decode
+    if max(data or [0]) < 0x80:
+        return data
+
+    numbers = []
+    number = 0
+    shift = 0
+
+    for byte in data:
+        number |= (byte & 0x7f) << shift
+
+        if byte & 0x80:
+            shift += 7
+        else:
+            numbers.append(number)
+            number = 0
+            shift = 0
+
+    return numbers
+
+def deltas(numbers):
+    previous = 0
+
+    for number in numbers:
+        yield number - previous
+        previous = number
+
+def packPositions(fieldPositions):
+    # {field: positions} -> field, count, position deltas, ... for each field
+    numbers = []
+
+    for field in sorted(fieldPositions):
+        positions = fieldPositions[field]
+        numbers.append(field)
+        numbers.append(len(positions))
+        numbers.extend(deltas(positions))
+
+    return packVarints(numbers)
+
+def unpackPositions(blob, offset=0):
+    # {field: set of positions}, less offset so the positions of a phrase's words line up
+    numbers = unpackVarints(blob)
+    fieldPositions = {}
+    index = 0
+
+    while index < len(numbers):
+        field = numbers[index]
+        end = index + 2 + numbers[index + 1]
+
+        positions = set()
+        position = -offset
+
+        for delta in numbers[index + 2:end]:
+            position += delta
+            positions.add(position)
+
+        fieldPositions[field] = positions
+        index = end
+
+    return fieldPositions
+
+def wordPairs(tokens):
+    # [(pair, position)] for each word and the next one when either is common. Indexed as
+    # terms of their own, so phrases with those words are looked up instead of pieced together
+    # from long position lists. The space keeps them apart from single words
+    return [(tokens[index] + u' ' + tokens[index + 1], index) for index in range(len(tokens) - 1)
+        if tokens[index] in COMMON_WORDS or tokens[index + 1] in COMMON_WORDS]
+
+def phraseTerms(tokens):
+    # [(term, offset)] covering every word of a phrase, pairs where indexed
+    terms = wordPairs(tokens)
+    covered = set()
+
+    for pair, offset in terms:
+        covered.update([offset, offset + 1])
+
+    terms.extend((token, offset) for offset, token in enumerate(tokens) if offset not in covered)
+
+    return terms
+
+def entryTexts(entry):
+    return [getattr(entry, field, None) or u'' for field, weight in FIELDS]
+
+def textsSignature(texts):
+    return hashlib.sha1(u'\0'.join(texts).encode('utf-8')).hexdigest()
+
+class TextIndex(object):
+    def __init__(self, path=DEFAULT_TEXT_INDEX_PATH):
+        self.connection = sqlite3.connect(path, timeout=60)
+
+        for statement in SCHEMA:
+            self.connection.execute(statement)
+
+        self.connection.commit()
+        self.statistics = None
+        self.termIds = None
+
+    def termId(self, term):
+        if self.termIds is None:
+            self.termIds = dict(self.connection.execute('SELECT term, id FROM terms'))
+
+        termId = self.termIds.get(term)
+
+        if termId is None:
+            termId = self.connection.execute('INSERT INTO terms (term) VALUES (?)', (term,)).lastrowid
+            self.termIds[term] = termId
+
+        return termId
+
+    def removeDocument(self, documentId, terms):
+        termIds = []
+        termId = 0
+
+        for delta in unpackVarints(terms):
+            termId += delta
+            termIds.append((termId, documentId))
+
+        self.connection.executemany('DELETE FROM postings WHERE term = ? AND document = ?', termIds)
+        self.connection.execute('DELETE FROM documents WHERE id = ?', (documentId,))
+
+    def addEntry(self, entry):
+        # Returns whether the entry was (re)indexed, unchanged entries are left alone
+        texts = entryTexts(entry)
+        signature = textsSignature(texts)
+
+        row = self.connection.execute('SELECT id, signature, terms FROM documents WHERE source = ?', (entry.source,)).fetchone()
+
+        if row is not None:
+            if row[1] == signature:
+                return False
+
+            self.removeDocument(row[0], row[2])
+
+        # {term: {field: positions}}
+        termPositions = {}
+        length = 0
+
+        for field, text in enumerate(texts):
+            tokens = tokenize(text)
+            length += len(tokens)
+
+            for position, token in enumerate(tokens):
+                termPositions.setdefault(token, {}).setdefault(field, []).append(position)
+
+            for pair, position in wordPairs(tokens):
+                termPositions.setdefault(pair, {}).setdefault(field, []).append(position)
+
+        termIds = sorted((self.termId(term), term) for term in termPositions)
+
+        cursor = self.connection.execute('INSERT INTO documents (source, title, length, signature, terms) VALUES (?, ?, ?, ?, ?)',
+            (entry.source, entry.title, length, signature, packVarints(deltas(termId for termId, term in termIds))))
+        documentId = cursor.lastrowid
+
+        postings = []
+
+        for termId, term in termIds:
+            fieldPositions = termPositions[term]
+            frequency = sum(FIELDS[field][1] * len(positions) for field, positions in fieldPositions.iteritems())
+            postings.append((termId, documentId, frequency, packPositions(fieldPositions)))
+
+        self.connection.executemany('INSERT INTO postings VALUES (?, ?, ?, ?)', postings)
+        self.statistics = None
+
+        return True
+
+    def update(self, entries, removeMissing=False):
+        # Reindexes new and changed entries. With removeMissing, entries not given are dropped too
+        sources = set()
+        changed = 0
+
+        for entry in entries:
+            if entry is None:
+                continue
+
+            sources.add(entry.source)
+
+            if self.addEntry(entry):
+                changed += 1
+
+        removed = 0
+
+        if removeMissing:
+            for documentId, source, terms in self.connection.execute('SELECT id, source, terms FROM documents').fetchall():
+                if source not in sources:
+                    self.removeDocument(documentId, terms)
+                    removed += 1
+
+        self.connection.commit()
+        self.statistics = None
+
+        return (changed, removed)
+
+    def remove(self, source):
+        row = self.connection.execute('SELECT id, terms FROM documents WHERE source = ?', (source,)).fetchone()
+
+        if row is not None:
+            self.removeDocument(row[0], row[1])
+            self.connection.commit()
+            self.statistics = None
+
+    def documentStatistics(self):
+        # (document count, average length) for BM25
+        if self.statistics is None:
+            count, averageLength = self.connection.execute('SELECT COUNT(*), AVG(length) FROM documents').fetchone()
+            self.statistics = (count, averageLength or 0.0)
+
+        return self.statistics
+
+    def wordFrequencies(self, term):
+        # {document: field weighted count}
+        return dict(self.connection.execute('SELECT document, frequency FROM postings '
+            'WHERE term = (SELECT id FROM terms WHERE term = ?)', (term,)))
+
+    def phraseFrequencies(self, terms, candidates):
+        # ({document: field weighted count} of a phrase, documents matching) from its phraseTerms.
+        # sqlite pairs up the documents holding every term through the primary key, so positions
+        # are only unpacked where the phrase can be. With candidates given, documents matching
+        # counts those with every term rather than the phrase itself
+        columns = ', '.join('p%d.positions' % index for index in range(len(terms)))
+        joins = ''.join(' JOIN postings p%d ON p%d.term = (SELECT id FROM terms WHERE term = ?) AND p%d.document = p0.document' % ((index,) * 3)
+            for index in range(1, len(terms)))
+        rows = self.connection.execute('SELECT p0.document, ' + columns + ' FROM postings p0' + joins +
+            ' WHERE p0.term = (SELECT id FROM terms WHERE term = ?)', [term for term, offset in terms[1:] + terms[:1]])
+
+        documents = set()
+        frequencies = {}
+
+        for row in rows:
+            document = row[0]
+            documents.add(document)
+
+            if candidates is not None and document not in candidates:
+                continue
+
+            # Where the phrase starts is wherever every term is at its offset from there
+            starts = unpackPositions(row[1], terms[0][1])
+
+            for (term, offset), positions in zip(terms[1:], row[2:]):
+                fieldPositions = unpackPositions(positions, offset)
+                starts = dict((field, starts[field] & fieldPositions[field]) for field in starts if field in fieldPositions)
+
+            frequency = sum(FIELDS[field][1] * len(positions) for field, positions in starts.iteritems())
+
+            if frequency > 0:
+                frequencies[document] = frequency
+
+        if candidates is None:
+            return (frequencies, len(frequencies))
+
+        return (frequencies, len(documents))
+
+    def search(self, query, resultCount=DEFAULT_RESULT_COUNT):
+        # [(score, source, title)] best first. Every word and "quoted phrase" has to appear
+        parts = []
+
+        for phrase, word in QUERY_PART.findall(query):
+            tokens = tokenize(phrase or word)
+
+            if tokens:
+                parts.append(tokens)
+
+        if not parts:
+            return []
+
+        # Words first, so positions are only read for documents that already match those
+        parts.sort(key=len)
+
+        partFrequencies = []
+        candidates = None
+
+        for tokens in parts:
+            terms = phraseTerms(tokens)
+
+            if len(terms) == 1:
+                frequencies = self.wordFrequencies(terms[0][0])
+                matching = len(frequencies)
+            else:
+                frequencies, matching = self.phraseFrequencies(terms, candidates)
+
+            partFrequencies.append((matching, frequencies))
+            candidates = set(frequencies) if candidates is None else candidates.intersection(frequencies)
+
+            if not candidates:
+                return []
+
+        documentCount, averageLength = self.documentStatistics()
+        lengths = self.documentLengths(candidates)
+        averageLength = max(averageLength, 1.0)
+        scores = dict.fromkeys(candidates, 0.0)
+
+        for matching, frequencies in partFrequencies:
+            inverseFrequency = math.log(1.0 + (documentCount - matching + 0.5) / (matching + 0.5))
+
+            for document in candidates:
+                frequency = frequencies[document]
+                normalization = BM25_K1 * (1.0 - BM25_B + BM25_B * lengths[document] / averageLength)
+                scores[document] += inverseFrequency * frequency * (BM25_K1 + 1.0) / (frequency + normalization)
+
+        best = heapq.nsmallest(resultCount, scores.iteritems(), key=lambda item: (-item[1], item[0]))
+        results = []
+
+        for document, score in best:
+            source, title = self.connection.execute('SELECT source, title FROM documents WHERE id = ?', (document,)).fetchone()
+            results.append((score, source, title))
+
+        return results
+
+    def documentLengths(self, documents):
+        if len(documents) > SQL_VARIABLE_LIMIT:
+            return dict(self.connection.execute('SELECT id, length FROM documents'))
+
+        documents = list(documents)
+
+        return dict(self.connection.execute('SELECT id, length FROM documents WHERE id IN (' + ', '.join('?' * len(documents)) + ')', documents))
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+def main():
+    # python textIndex.py build [firstYear lastYear]
+    # python textIndex.py search <words or "quoted phrases">
+    if len(sys.argv) < 2 or sys.argv[1] not in ['build', 'search']:
+        print 'Usage: textIndex.py build [firstYear lastYear] | search <query>'
+        sys.exit(1)
+
+    index = TextIndex()
+
+    if sys.argv[1] == 'build':
+        firstYear = 1984
+        lastYear = 2010
+
+        if len(sys.argv) > 3:
+            firstYear = int(sys.argv[2])
+            lastYear = int(sys.argv[3])
+
+        def yearEntries():
+            for year in range(firstYear, lastYear + 1):
+                for entry in iterYearEntries(year):
+                    yield entry
+
+        changed, removed = index.update(yearEntries(), removeMissing=True)
+        print 'Indexed ' + str(changed) + ' new or changed entries, removed ' + str(removed)
+    else:
+        query = ' '.join(sys.argv[2:]).decode('utf-8')
+
+        start = time.time()
+        results = index.search(query)
+        elapsed = time.time() - start
+
+        for score, source, title in results:
+            print '%.3f\t%s\t%s' % (score, source, title)
+
+        print '%d results in %.1fms' % (len(results), elapsed * 1000)
+
+    index.close()
+
+if __name__ == '__main__':
+    main()
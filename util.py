@@ -1,8 +1,23 @@
-import codecs
+import gzip
+import io
 import json
+import random
 import re
 import requests
+import threading
+import time
+import traceback
 from bs4 import BeautifulSoup, NavigableString
+from requests.adapters import HTTPAdapter
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+import crawlMetrics
+import rateLimit
+from responseCache import CacheMissError
 
 BASE_URL = 'http://macintoshgarden.org'
 
@@ -12,6 +27,26 @@ STRIP_MULT_SPACES = re.compile(r'\ +')
 SPACE_BEFORE_PUNCT = set(['('])
 SPACE_AFTER_PUNCT = set(['.', ',', '!', '?', '\"', ')'])
 
+PARSERS = ['lxml', 'html.parser', 'html5lib']
+
+MAX_ATTEMPTS = 4
+RETRY_BACKOFF = 2
+
+# At least as many connections as fetch threads
+POOL_SIZE = 16
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 60
+
+# Model class name written alongside each serialised Entry/Application/Rating
+TYPE_KEY = '_type'
+
+responseCache = None
+htmlParser = 'html5lib'
+targetedParsing = False
+session = None
+sessionLock = threading.Lock()
+stripPatterns = {}
+
 def hasKeys(dictionary, keys):
     for key in keys:
         if key not in dictionary:
@@ -30,23 +65,34 @@ def concatStringsWithSpace(str1, str2):
     if str2 is None or len(str2) < 1:
         return str1
 
-    lastChar = str1[-1]
-    firstChar = str2[0]
-
-    if (lastChar.isalnum() or lastChar in SPACE_AFTER_PUNCT) and (firstChar.isalnum() or firstChar in SPACE_BEFORE_PUNCT):
-        # Space is needed
+    if needsSpace(str1[-1], str2[0]):
         return str1 + ' ' + str2
 
     return str1 + str2
 
+def needsSpace(lastChar, firstChar):
+    return (lastChar.isalnum() or lastChar in SPACE_AFTER_PUNCT) and (firstChar.isalnum() or firstChar in SPACE_BEFORE_PUNCT)
+
 def stripMultipleSpaces(string):
     return STRIP_MULT_SPACES.sub(' ', string)
 
+def stripPattern(stripString, possessive=True):
+    # Compiled once per word or name, re's own cache is cleared every 100 patterns
+    # and the authors and publishers alone go well past that
+    key = (stripString, possessive)
+    pattern = stripPatterns.get(key)
+
+    if pattern is None:
+        possessiveString = r''
+        if possessive:
+            possessiveString = r'(\'s)?'
+        pattern = re.compile(r'(^|\b|\s)' + re.escape(stripString) + possessiveString + r'(\b|\s|$)', re.IGNORECASE)
+        stripPatterns[key] = pattern
+
+    return pattern
+
 def stripStringFromString(stripString, strippedString, possessive=True):
-    possessiveString = r''
-    if possessive:
-        possessiveString = r'(\'s)?'
-    return re.sub(r'(^|\b|\s)' + re.escape(stripString) + possessiveString + r'(\b|\s|$)', ' ', strippedString, flags=re.IGNORECASE)
+    return stripPattern(stripString, possessive).sub(' ', strippedString)
 
 def stringRemoveCenter(string, start, end):
     return string[0:start] + string[end:]
@@ -63,42 +109,202 @@ def convertNone(o):
 
     return None
 
-def writeFile(text):
-    f = codecs.open('download.html', 'w', 'utf-8')
-    f.write(text)
-    f.close()
-
-def getFile():
-    f = codecs.open('download.html', 'r', 'utf-8')
-    text = f.read()
-    f.close()
-    return unicode(text)
-
 class Encoder(json.JSONEncoder):
     def default(self, obj):  # pylint: disable=E0202
+        # Slotted models have no __dict__ for vars()
+        if hasattr(obj, 'toDict'):
+            dictionary = obj.toDict()
+            # Lets the loader construct the model directly instead of guessing from keys
+            dictionary[TYPE_KEY] = type(obj).__name__
+            return dictionary
+
         return vars(obj)
 
+def toJSON(data):
+    return json.dumps(data, cls=Encoder, sort_keys=True)
+
 def save(data, name='data.json'):
     with open(name, 'w') as outfile:
-        json.dump(data, outfile, cls=Encoder)
+        # dumps() can use json's C encoder, dump() always runs the pure Python one
+        outfile.write(json.dumps(data, cls=Encoder))
+
+def openCompressed(name, mode):
+    if name.endswith('.gz'):
+        return gzip.open(name, mode + 'b')
+
+    if name.endswith('.zst'):
+        if zstandard is None:
+            raise ValueError('zstandard is not installed, cannot open ' + name)
+
+        if mode == 'r':
+            return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(open(name, 'rb'), read_across_frames=True))
+
+        return zstandard.ZstdCompressor().stream_writer(open(name, mode + 'b'))
+
+    return open(name, mode + 'b')
+
+class JsonLinesWriter(object):
+    def __init__(self, name, mode='a'):
+        self.file = openCompressed(name, mode)
+        self.zstd = name.endswith('.zst')
+
+    def write(self, data):
+        self.file.write(json.dumps(data, cls=Encoder) + '\n')
+
+        if self.zstd:
+            # Emit a complete block so the line is readable even if the process dies
+            self.file.flush(zstandard.FLUSH_BLOCK)
+        else:
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+def createSession(poolSize=POOL_SIZE):
+    newSession = requests.Session()
+
+    # Keep-alive connections are reused by every thread fetching from the same host
+    adapter = HTTPAdapter(pool_connections=poolSize, pool_maxsize=poolSize)
+    newSession.mount('http://', adapter)
+    newSession.mount('https://', adapter)
+
+    newSession.headers.update({
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:65.0) Gecko/20100101 Firefox/65.0',
+        'Accept-Encoding': 'gzip, deflate',
+        'Connection': 'keep-alive',
+    })
+
+    return newSession
+
+def getSession():
+    global session
+
+    with sessionLock:
+        if session is None:
+            session = createSession()
 
-def get(url):
+        return session
+
+def setSessionPoolSize(poolSize):
+    global session
+
+    with sessionLock:
+        if session is not None:
+            session.close()
+
+        session = createSession(poolSize)
+
+def get(url, headers=None):
+    ticket = rateLimit.acquire(url)
     print 'Requesting url ' + url
-    return requests.get(url, headers={'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:65.0) Gecko/20100101 Firefox/65.0'})
 
-def getSoupFromPath(path):
+    start = time.time()
+    try:
+        response = getSession().get(url, headers=headers, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
+    except Exception as e:
+        rateLimit.release(ticket)
+        crawlMetrics.increment('request_errors_total', {'error': type(e).__name__})
+        raise
+
+    rateLimit.release(ticket, response.status_code, response.headers.get('Retry-After'))
+
+    crawlMetrics.observe('request_seconds', time.time() - start)
+    crawlMetrics.observe('response_bytes', len(response.content), crawlMetrics.BYTES_BUCKETS)
+    crawlMetrics.increment('requests_total', {'status': response.status_code})
+
+    if response.status_code == 429 or response.status_code >= 500:
+        # Throttled or failing, raise so tryCall backs off and retries
+        raise requests.HTTPError(str(response.status_code) + ' for ' + url, response=response)
+
+    return response
+
+def setResponseCache(cache):
+    global responseCache
+    responseCache = cache
+
+def getPageText(path, fresh=False):
+    # fresh skips cached copies, for pages that must reflect the site as it is now. Offline the cache is all there is
+    if responseCache is not None and (not fresh or responseCache.offline):
+        text = responseCache.get(path)
+
+        if text is not None:
+            return text
+
+        if responseCache.offline:
+            raise CacheMissError(path)
+
     response = get(BASE_URL + path)
     text = response.text
-    # writeFile(text)
-    # text = getFile()
 
+    if responseCache is not None and response.status_code == 200:
+        responseCache.put(path, text)
+
+    return text
+
+def getConditional(path, etag=None, lastModified=None):
+    headers = {}
+
+    if etag is not None:
+        headers['If-None-Match'] = etag
+
+    if lastModified is not None:
+        headers['If-Modified-Since'] = lastModified
+
+    response = get(BASE_URL + path, headers)
+
+    if responseCache is not None and response.status_code == 200:
+        responseCache.put(path, response.text)
+
+    return response
+
+def normalizeHtml(text):
+    with crawlMetrics.timer('normalize_seconds'):
+        return normalizeText(text)
+
+def normalizeText(text):
     # Replace newlines and tabs to prevent errors in string handling later
     text = text.translate({ord(c): ord(' ') for c in '\n\r\t'})
     text = text.replace('&nbsp;', ' ')
     text = STRIP_MULT_SPACES.sub(' ', text)
     text = STRIP_SPACES_AROUND_TAGS.sub('\g<1>', text)
 
-    return BeautifulSoup(text, 'html5lib')
+    return text
+
+def setParser(name, targeted=False):
+    global htmlParser, targetedParsing
+
+    if name not in PARSERS:
+        raise ValueError('Unknown parser ' + name)
+
+    htmlParser = name
+    targetedParsing = targeted
+
+def soupFromText(text, parserName=None):
+    text = normalizeHtml(text)
+    parserName = parserName or htmlParser
+
+    with crawlMetrics.timer('soup_build_seconds', {'parser': parserName}):
+        return BeautifulSoup(text, parserName)
+
+def getSoupFromPath(path, fresh=False):
+    return soupFromText(getPageText(path, fresh))
 
 def isYear(value):
-    return value.isdigit() and len(value) == 4
\ No newline at end of file
+    return value.isdigit() and len(value) == 4
+
+def tryCall(function, path, *args):
+    attempts = 0
+    while True:
+        attempts += 1
+        try:
+            return (path, function(path, *args), None, attempts)
+        except IOError:
+            # Network errors are usually transient, back off and try again
+            if attempts >= MAX_ATTEMPTS:
+                return (path, None, traceback.format_exc(), attempts)
+
+            delay = RETRY_BACKOFF * 2 ** (attempts - 1)
+            print 'Attempt ' + str(attempts) + ' for ' + path + ' failed, retrying in ' + str(delay) + 's'
+            time.sleep(delay + random.uniform(0, delay))
+        except:
+            return (path, None, traceback.format_exc(), attempts)
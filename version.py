@@ -0,0 +1,124 @@
+import operator
+import re
+
+# Digits then letters in each dot separated part, e.g. "2", "1a", "b"
+VERSION_PART = re.compile(r'([0-9]*)([a-z]*)', re.IGNORECASE)
+
+# Plain tuple comparisons, much quicker than going through Version.__lt__
+VERSION_KEY = operator.attrgetter('key')
+
+# Every parsed version by its text, so each string is only parsed once per run
+parsedVersions = {}
+
+class Version(object):
+    # Compared by key, a tuple of (number, letters) per part with trailing zero parts dropped,
+    # so 1.10 sorts after 1.9, 5.1a after 5.1, and 1.0 equals 1. number is major and minor
+    # as the float they read as, see versionNumber
+    __slots__ = ('text', 'key', 'number')
+
+    def __init__(self, text, key, number):
+        object.__setattr__(self, 'text', text)
+        object.__setattr__(self, 'key', key)
+        object.__setattr__(self, 'number', number)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Version is immutable')
+
+    def __delattr__(self, name):
+        raise AttributeError('Version is immutable')
+
+    @property
+    def major(self):
+        if not self.key:
+            return 0
+
+        return self.key[0][0]
+
+    def __eq__(self, other):
+        return isinstance(other, Version) and self.key == other.key
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __lt__(self, other):
+        return self.key < other.key
+
+    def __le__(self, other):
+        return self.key <= other.key
+
+    def __gt__(self, other):
+        return self.key > other.key
+
+    def __ge__(self, other):
+        return self.key >= other.key
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __reduce__(self):
+        return (parseVersion, (self.text,))
+
+    def __repr__(self):
+        return 'Version(' + repr(self.text) + ')'
+
+    def __str__(self):
+        return str(self.text)
+
+def versionKey(text):
+    # None when there isn't a single digit to go on
+    parts = []
+    hasDigits = False
+
+    # A leading "v" as in "v1.2"
+    if text[:1] in ('v', 'V'):
+        text = text[1:]
+
+    for part in text.split('.'):
+        partMatch = VERSION_PART.match(part)
+
+        if partMatch.end() != len(part):
+            return None
+
+        digits, letters = partMatch.groups()
+
+        if digits:
+            hasDigits = True
+
+        parts.append((int(digits or 0), letters.lower()))
+
+    if not hasDigits:
+        return None
+
+    while parts and parts[-1] == (0, ''):
+        parts.pop()
+
+    return tuple(parts)
+
+def versionNumber(text):
+    # "3.5b" -> 3.5, "1.2.3" -> 1.2, "1.05" -> 1.05. Only for text versionKey accepts
+    if text[:1] in ('v', 'V'):
+        text = text[1:]
+
+    parts = text.split('.', 2)
+    major = VERSION_PART.match(parts[0]).group(1) or '0'
+    minor = VERSION_PART.match(parts[1]).group(1) if len(parts) > 1 else ''
+
+    return float(major + '.' + (minor or '0'))
+
+def parseVersion(text):
+    # The same Version for the same text, or None when text isn't a version number
+    if text in parsedVersions:
+        return parsedVersions[text]
+
+    key = versionKey(text)
+    version = Version(text, key, versionNumber(text)) if key is not None else None
+    parsedVersions[text] = version
+
+    return version
+
+def versionRange(versions):
+    # (lowest, highest) in one pass each over plain tuples, the first one wins ties
+    if not versions:
+        return None
+
+    return (min(versions, key=VERSION_KEY), max(versions, key=VERSION_KEY))
@@ -0,0 +1,102 @@
+import sqlite3
+import threading
+import time
+
+DEFAULT_QUEUE_PATH = 'data/workQueue.db'
+DEFAULT_LEASE = 120
+
+PENDING = 'pending'
+LEASED = 'leased'
+DONE = 'done'
+
+class LeaseLostError(Exception):
+    # Another worker took over the year, this one has to stop writing it
+    pass
+
+class WorkQueue(object):
+    def __init__(self, path=DEFAULT_QUEUE_PATH):
+        self.path = path
+        # Several workers share the file, wait for their writes instead of failing
+        self.connection = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS jobs (year INTEGER PRIMARY KEY, status TEXT, owner TEXT, leaseExpires REAL, attempts INTEGER)')
+
+    def enqueue(self, years, restart=False):
+        # Years already done are only queued again with restart, otherwise workers joining
+        # later would redo what the others just finished
+        self.connection.execute('BEGIN IMMEDIATE')
+        for year in years:
+            self.connection.execute('INSERT OR IGNORE INTO jobs VALUES (?, ?, NULL, NULL, 0)', (year, PENDING))
+            if restart:
+                self.connection.execute('UPDATE jobs SET status = ?, owner = NULL, leaseExpires = NULL, attempts = 0 WHERE year = ? AND status = ?',
+                    (PENDING, year, DONE))
+        self.connection.execute('COMMIT')
+
+    def claim(self, owner, lease=DEFAULT_LEASE):
+        now = time.time()
+
+        # Take the write lock up front so no two workers claim the same year
+        self.connection.execute('BEGIN IMMEDIATE')
+        row = self.connection.execute('SELECT year FROM jobs WHERE status = ? OR (status = ? AND leaseExpires < ?) ORDER BY year LIMIT 1',
+            (PENDING, LEASED, now)).fetchone()
+
+        if row is None:
+            self.connection.execute('COMMIT')
+            return None
+
+        self.connection.execute('UPDATE jobs SET status = ?, owner = ?, leaseExpires = ?, attempts = attempts + 1 WHERE year = ?', (LEASED, owner, now + lease, row[0]))
+        self.connection.execute('COMMIT')
+
+        return row[0]
+
+    def heartbeat(self, year, owner, lease=DEFAULT_LEASE):
+        cursor = self.connection.execute('UPDATE jobs SET leaseExpires = ? WHERE year = ? AND owner = ? AND status = ?', (time.time() + lease, year, owner, LEASED))
+
+        return cursor.rowcount > 0
+
+    def complete(self, year, owner):
+        cursor = self.connection.execute('UPDATE jobs SET status = ?, leaseExpires = NULL WHERE year = ? AND owner = ? AND status = ?', (DONE, year, owner, LEASED))
+
+        return cursor.rowcount > 0
+
+    def release(self, year, owner):
+        self.connection.execute('UPDATE jobs SET status = ?, owner = NULL, leaseExpires = NULL WHERE year = ? AND owner = ? AND status = ?', (PENDING, year, owner, LEASED))
+
+    def remaining(self):
+        return self.connection.execute('SELECT COUNT(*) FROM jobs WHERE status != ?', (DONE,)).fetchone()[0]
+
+    def doneCount(self):
+        return self.connection.execute('SELECT COUNT(*) FROM jobs WHERE status = ?', (DONE,)).fetchone()[0]
+
+    def close(self):
+        self.connection.close()
+
+class Heartbeat(threading.Thread):
+    def __init__(self, path, year, owner, lease=DEFAULT_LEASE):
+        super(Heartbeat, self).__init__()
+        self.daemon = True
+        self.path = path
+        self.year = year
+        self.owner = owner
+        self.lease = lease
+        self.stopped = threading.Event()
+        self.lost = False
+
+    def run(self):
+        # SQLite connections can't be shared between threads
+        queue = WorkQueue(self.path)
+
+        while not self.stopped.wait(self.lease / 3.0):
+            if not queue.heartbeat(self.year, self.owner, self.lease):
+                print 'Lost lease on ' + str(self.year)
+                self.lost = True
+                break
+
+        queue.close()
+
+    def check(self):
+        if self.lost:
+            raise LeaseLostError('Lost lease on ' + str(self.year))
+
+    def stop(self):
+        self.stopped.set()
+        self.join()